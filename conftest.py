@@ -0,0 +1,64 @@
+import os
+from pathlib import Path
+
+from tb import coverage, perf, suite
+from tb.runner import BUILD_ROOT, WAVES_MODES, parameter_id
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--waves", choices=WAVES_MODES, default=None,
+        help="Waveform mode, overrides `WAVES`: 1 = always, 0 = never, "
+             "fail = only re-run failing tests with tracing")
+
+
+def pytest_configure(config):
+    waves = config.getoption("--waves")
+    if waves is not None:
+        os.environ["WAVES"] = waves
+
+    # Only on the controller, workers inherit the snapshot
+    if not hasattr(config, "workerinput"):
+        workers = getattr(config.option, "numprocesses", None) or 1
+        suite.snapshot(BUILD_ROOT, workers)
+
+
+def pytest_generate_tests(metafunc):
+    """Shards the cocotb tests of a module with a `testcase` argument"""
+    if "testcase" not in metafunc.fixturenames:
+        return
+
+    toplevel = Path(metafunc.module.__file__).stem.removesuffix("_test")
+    testcases = suite.plan(metafunc.module, toplevel, suite.load_snapshot())
+    ids = ["all"] if len(testcases) == 1 else \
+        [f"shard{i + 1}of{len(testcases)}" for i in range(len(testcases))]
+    metafunc.parametrize("testcase", testcases, ids=ids)
+
+
+def pytest_collection_modifyitems(config, items):
+    """Longest simulator processes first, unknown ones before all others"""
+    snapshot = suite.load_snapshot()
+
+    def expected_runtime(item) -> float:
+        params = getattr(item, "callspec", None)
+        params = params.params if params is not None else {}
+        if "testcase" not in params:
+            return 0.0
+
+        toplevel = Path(item.fspath).stem.removesuffix("_test")
+        parameters = params.get("parameters")
+        return suite.expected_runtime(
+            snapshot, toplevel,
+            parameter_id(parameters) if parameters else perf.DEFAULT_ID,
+            params["testcase"])
+
+    # Stable sort keeps the order of definition for equal runtimes
+    items.sort(key=lambda item: -expected_runtime(item))
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    """Coverage merged from all workers, see `tb.coverage`"""
+    if coverage.enabled() and not hasattr(config, "workerinput"):
+        terminalreporter.write_sep("-", "functional coverage")
+        terminalreporter.write_line(coverage.report(BUILD_ROOT)
+                                    or "No coverage recorded")
@@ -1,32 +1,370 @@
-from cocotb.triggers import Timer
+from fractions import Fraction
+from typing import List, NamedTuple, Optional, Sequence, Union
 
+import cocotb
+import numpy as np
+from cocotb.queue import Queue
+from cocotb.triggers import (ClockCycles, FallingEdge, ReadOnly, RisingEdge,
+                             Timer)
+from cocotb.utils import get_sim_time
+from tb import stimulus, watchdog
+from tb.timing import bit_cycles
 
-async def send_symbol(dut, baud: int, value: int, bits: int = 8,
-                      parity=False, parity_odd=False):
-    assert value <= 0xFF and value >= 0, f"Provided byte is not valid: {value}"
-    assert bits == 8
+# Encoding of `state_t` in uart_rx
+RX_STATES = ["IDLE", "START_BIT", "DATA_BITS", "PARITY_BIT", "STOP_BIT",
+             "ERROR"]
+RX_TRANSITIONS = [("IDLE", "START_BIT"), ("START_BIT", "DATA_BITS"),
+                  ("START_BIT", "ERROR"), ("DATA_BITS", "PARITY_BIT"),
+                  ("DATA_BITS", "STOP_BIT"), ("PARITY_BIT", "STOP_BIT"),
+                  ("PARITY_BIT", "ERROR"), ("STOP_BIT", "IDLE"),
+                  ("STOP_BIT", "ERROR"), ("ERROR", "IDLE")]
+# Encoding of `state_t` in uart_tx, STOP_BIT->START_BIT sends back-to-back
+TX_STATES = ["IDLE", "START_BIT", "DATA_BITS", "PARITY_BIT", "STOP_BIT"]
+TX_TRANSITIONS = [("IDLE", "START_BIT"), ("START_BIT", "DATA_BITS"),
+                  ("DATA_BITS", "PARITY_BIT"), ("DATA_BITS", "STOP_BIT"),
+                  ("PARITY_BIT", "STOP_BIT"), ("STOP_BIT", "IDLE"),
+                  ("STOP_BIT", "START_BIT")]
+# Longest frame: Start, 9 data, parity and two stop bits
+MAX_FRAME_BITS = 13
 
-    cycle = 1. / float(baud)
-    time_bit = Timer(int(cycle * 1e9), 'ns')
+
+def frame_cycles(baud_divider: int) -> int:
+    """Clock cycles of the longest frame, to bound waits for a frame"""
+    return MAX_FRAME_BITS * bit_cycles(baud_divider)
+
+
+class BitClock:
+    """
+    Waits whole and half UART bit periods, counted in rising edges of `clk`.
+    Waits must start at a rising edge of `clk`. If the period of `clk` is known,
+    all but the last edge are skipped with a single `Timer` (fast path) that
+    ends half a clock cycle before the last edge and thus can't race with it.
+    """
+
+    def __init__(self, clk, baud_divider: int,
+                 clk_period_ps: Optional[int] = None):
+        self.cycles = bit_cycles(baud_divider)
+        self.edge = RisingEdge(clk)
+        self.half_cycles = self.cycles // 2
+        self.skip_bit = self._skip(clk, self.cycles, clk_period_ps)
+        self.skip_half_bit = self._skip(clk, self.half_cycles, clk_period_ps)
+
+    @staticmethod
+    def _skip(clk, cycles: int, clk_period_ps: Optional[int]):
+        """Trigger that fires within the clock cycle before edge `cycles`"""
+        if cycles <= 1:
+            return None
+        if clk_period_ps is None:
+            return ClockCycles(clk, cycles - 1)
+        return Timer(cycles * clk_period_ps - clk_period_ps // 2, "ps")
+
+    async def bit(self) -> None:
+        if self.skip_bit is not None:
+            await self.skip_bit
+        await self.edge
+
+    async def half_bit(self) -> None:
+        if self.half_cycles == 0:
+            return
+        if self.skip_half_bit is not None:
+            await self.skip_half_bit
+        await self.edge
+
+
+async def drive_line(signal, levels: Sequence[int],
+                     bit_period_ps: Union[int, Fraction], ppm: float = 0,
+                     jitter: float = 0, glitches: float = 0,
+                     glitch_width: float = 1 / 32,
+                     rng: Optional[np.random.Generator] = None) -> None:
+    """
+    Drives line levels with an own transmitter clock, independent of the clock
+    of the receiver: Bits last `bit_period_ps` deviating by `ppm` and each edge
+    but the first is displaced by up to `jitter` bit periods (uniformly
+    distributed). With probability `glitches`, a bit is inverted for
+    `glitch_width` bit periods at its centre, where a receiver samples it.
+    Times are rounded to ns, the simulator precision.
+    """
+    assert 0 <= jitter < 0.5, "Edges must stay in order"
+    period_ns = float(bit_period_ps) * (1 + ppm * 1e-6) / 1000
+    if rng is None:
+        rng = stimulus.rng()
+    offsets = rng.uniform(-jitter, jitter, len(levels) + 1)
+    offsets[0] = offsets[-1] = 0
+    edges = np.rint((np.arange(len(levels) + 1) + offsets) * period_ns)
+    glitched = rng.random(len(levels)) < glitches
+    width = max(1, round(glitch_width * period_ns))
+
+    for level, duration, glitch in zip(levels,
+                                       np.diff(edges).astype(int).tolist(),
+                                       glitched.tolist()):
+        signal.value = level
+        if glitch and duration > width:
+            position = (duration - width) // 2
+            if position > 0:
+                await Timer(position, "ns")
+            signal.value = 1 - level
+            await Timer(width, "ns")
+            signal.value = level
+            duration -= position + width
+        if duration > 0:
+            await Timer(duration, "ns")
+
+
+async def send_frame(dut, baud_divider: int, levels: Sequence[int],
+                     clk_period_ps: Optional[int] = None,
+                     bit_period_ps: Optional[Union[int, Fraction]] = None,
+                     **distortion):
+    """
+    Drives precomputed line levels, one per bit (see `stimulus.uart_frames`),
+    on `dut.rx`, aligned to the rising edges of `dut.clk`. With
+    `bit_period_ps` or `distortion` (`ppm`, `jitter`, `glitches`, ... see
+    `drive_line`) the bits are timed by `drive_line` instead, by default with
+    the period of `baud_divider`.
+    """
+    if bit_period_ps is not None or distortion:
+        if bit_period_ps is None:
+            assert clk_period_ps is not None, "Bit period is unknown"
+            bit_period_ps = bit_cycles(baud_divider) * clk_period_ps
+        await drive_line(dut.rx, levels, bit_period_ps, **distortion)
+        return
+
+    timing = BitClock(dut.clk, baud_divider, clk_period_ps)
+    await RisingEdge(dut.clk)
+
+    for level in levels:
+        dut.rx.value = level
+        await timing.bit()
+
+
+async def send_symbol(dut, baud_divider: int, value: int, bits: int = 8,
+                      parity=False, parity_odd=False,
+                      clk_period_ps: Optional[int] = None,
+                      stop_bits: int = 1, **timing):
+    """
+    Drives one frame on `dut.rx`, aligned to the rising edges of `dut.clk`
+    or timed by `bit_period_ps` and distorted (see `send_frame`)
+    """
+    assert 0 <= value < 2**bits, f"Provided symbol is not valid: {value}"
+
+    levels = stimulus.uart_frames([value], bits, parity, parity_odd,
+                                  stop_bits)[0]
+    await send_frame(dut, baud_divider, levels.tolist(), clk_period_ps,
+                     **timing)
+
+
+class UartFrame(NamedTuple):
+    value: int
+    start_error: bool = False
+    parity_error: bool = False
+    stop_error: bool = False
+
+    @property
+    def framing_error(self) -> bool:
+        return self.start_error or self.stop_error
+
+    @property
+    def valid(self) -> bool:
+        return not (self.framing_error or self.parity_error)
+
+
+async def sample_frame(signal, timing: BitClock, bits: int = 8,
+                       parity=False, parity_odd=False,
+                       stop_bits: int = 1) -> UartFrame:
+    """Samples one frame at the bit centres. Starts at the falling edge"""
+    value = 0
 
     # Start bit
-    dut.rx.value = 0
-    await time_bit
+    await timing.half_bit()
+    start_error = signal.value != 0
 
     # Data bits
-    parity = 0
+    parity_bit = 0
     for i in range(bits):
-        bit = (value >> i) & 1
-        dut.rx.value = bit
-        parity = parity ^ bit
-        await time_bit
+        await timing.bit()
+        data_bit = signal.value & 1
+
+        value |= data_bit << i
+        parity_bit ^= data_bit
 
     # Parity bit
+    parity_error = False
     if parity is True:
-        assert parity >= 0 and parity <= 1
-        dut.rx.value = 1 ^ parity if parity_odd else parity
-        await time_bit
+        await timing.bit()
+        data_bit = signal.value & 1
+
+        parity_bit = 1 ^ parity_bit if parity_odd else parity_bit
+        parity_error = parity_bit != data_bit
+
+    # Stop bits
+    stop_error = False
+    for _ in range(stop_bits):
+        await timing.bit()
+        stop_error |= signal.value != 1
+
+    return UartFrame(value, start_error, parity_error, stop_error)
+
+
+async def receive_symbol(dut, baud_divider: int, bits: int = 8,
+                         parity=False, parity_odd=False,
+                         clk_period_ps: Optional[int] = None,
+                         timeout_cycles: Optional[int] = None,
+                         stop_bits: int = 1) -> int:
+    """
+    Waits for a frame on `dut.tx` and samples each bit at its centre. Fails
+    unless the frame starts within `timeout_cycles` (default: two frames)
+    """
+    timing = BitClock(dut.clk, baud_divider, clk_period_ps)
+    if timeout_cycles is None:
+        timeout_cycles = 2 * frame_cycles(baud_divider)
+
+    # Wait for start. `tx` is driven from registers -> Aligned to `clk`
+    await watchdog.wait(dut, FallingEdge(dut.tx), timeout_cycles,
+                        "Frame should start", clk_period_ps)
+    frame = await sample_frame(dut.tx, timing, bits, parity, parity_odd,
+                               stop_bits)
+
+    assert not frame.start_error, "Start bit is invalid"
+    assert not frame.parity_error, "Parity does not match!"
+    assert not frame.stop_error, "Stop bit is invalid"
+    return frame.value
+
+
+class UartMonitor:
+    """
+    Long-lived receiver, that continuously decodes frames on `signal` and
+    pushes them as `UartFrame` into `queue`. Frames with framing or parity
+    errors are queued as well and counted in `errors`. The start of each
+    frame is recorded in `starts` (ps).
+    """
+
+    def __init__(self, clk, signal, baud_divider: int, bits: int = 8,
+                 parity=False, parity_odd=False,
+                 clk_period_ps: Optional[int] = None, stop_bits: int = 1):
+        self.signal = signal
+        self.timing = BitClock(clk, baud_divider, clk_period_ps)
+        self.bits = bits
+        self.parity = parity
+        self.parity_odd = parity_odd
+        self.stop_bits = stop_bits
+
+        self.queue: Queue[UartFrame] = Queue()
+        self.frames = 0
+        self.errors = 0
+        self.starts: List[int] = []
+        self._task = None
+
+    def start(self) -> "UartMonitor":
+        assert self._task is None, "Monitor is already running"
+        self._task = cocotb.start_soon(self._run())
+        return self
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.kill()
+            self._task = None
+
+    async def _run(self) -> None:
+        start = FallingEdge(self.signal)
+        while True:
+            await start
+            self.starts.append(get_sim_time("ps"))
+            frame = await sample_frame(self.signal, self.timing, self.bits,
+                                       self.parity, self.parity_odd,
+                                       self.stop_bits)
+            self.frames += 1
+            self.errors += 0 if frame.valid else 1
+            self.queue.put_nowait(frame)
+
+    async def read(self) -> int:
+        """Next received value. Fails on framing or parity errors"""
+        frame = await self.queue.get()
+        assert not frame.start_error, "Start bit is invalid"
+        assert not frame.parity_error, "Parity does not match!"
+        assert not frame.stop_error, "Stop bit is invalid"
+        return frame.value
+
+    async def read_bytes(self, count: int) -> List[int]:
+        return [await self.read() for _ in range(count)]
+
+    def gaps(self, frame_cycles: int, clk_period_ps: int) -> List[int]:
+        """Idle clock cycles between the stop bit and the next start bit"""
+        return [(later - earlier) // clk_period_ps - frame_cycles
+                for earlier, later in zip(self.starts, self.starts[1:])]
+
+
+async def write_buffer(dut, data: Union[bytes, bytearray, memoryview]) -> float:
+    """
+    Feeds `data` into the write port (`we`, `data`, `buffer_full`) of
+    `uart_buffered_tx`, one byte per clock while the buffer is not full.
+    Any contiguous byte buffer works, e.g. a `numpy.uint8` array.
+    Inputs change at the falling edge of `dut.clk`. While full, it sleeps until
+    `buffer_full` drops instead of polling each cycle.
+    Returns the achieved throughput in bytes per simulated second.
+    """
+    payload = memoryview(data).cast("B")
+    clk_falling = FallingEdge(dut.clk)
+    full_falling = FallingEdge(dut.buffer_full)
+
+    await clk_falling
+    start = get_sim_time("ns")
+
+    i = 0
+    while i < len(payload):
+        if dut.buffer_full.value == 1:
+            dut.we.value = 0
+            await full_falling
+            await clk_falling
+            continue
+
+        dut.data.value = payload[i]
+        dut.we.value = 1
+        i += 1
+        await clk_falling
+
+    dut.we.value = 0
+    elapsed_ns = get_sim_time("ns") - start
+    return len(payload) / (elapsed_ns * 1e-9) if elapsed_ns else float("inf")
+
+
+async def read_buffer(dut, count: int) -> List[int]:
+    """
+    Reads `count` bytes from the read port (`re`, `data`, `buffer_empty`) of
+    `uart_buffered_rx` as soon as they are available, one byte per clock.
+    `re` changes at the falling edge of `dut.clk`, `data` is sampled once it
+    settled. While empty, it sleeps until `buffer_empty` drops.
+    """
+    received = []
+    clk_falling = FallingEdge(dut.clk)
+    empty_falling = FallingEdge(dut.buffer_empty)
+    settled = ReadOnly()
+
+    await clk_falling
+    while len(received) < count:
+        if dut.buffer_empty.value == 1:
+            dut.re.value = 0
+            await empty_falling
+            await clk_falling
+            continue
+
+        dut.re.value = 1
+        await settled
+        received.append(dut.data.value.integer)
+        await clk_falling
+
+    dut.re.value = 0
+    return received
+
 
-    # Stop bit
-    dut.rx.value = 1
-    await time_bit
+async def read_valid(valid, data, count: int) -> List[int]:
+    """
+    Samples `data` at the next `count` pulses of `valid`, like the
+    `valid_data` and `data` outputs of `uart_rx`. `data` is sampled after
+    all updates of the time step, as it changes in the same one as `valid`
+    """
+    received = []
+    rising, settled = RisingEdge(valid), ReadOnly()
+    while len(received) < count:
+        await rising
+        await settled
+        received.append(data.value.integer)
+    return received
@@ -0,0 +1,40 @@
+`timescale 1us / 1ns
+
+// Description: Fractional part of the baud rate divider of `uart_tx` and
+//              `uart_rx`. A bit lasts `baud_divider + 1` clock cycles and one
+//              more (`extend`) whenever the accumulator of `baud_fraction`
+//              overflows. On average a bit thus lasts
+//              `baud_divider + 1 + baud_fraction / 2**FRACTION_WIDTH` cycles.
+//              `baud_fraction = 0` is the plain integer divider.
+module uart_baud_fraction #(
+    parameter int FRACTION_WIDTH = 4
+) (
+    // System
+    input  logic                      clk,
+    input  logic                      rst,
+    // Bit timing
+    input  logic                      restart,
+    input  logic                      bit_end,
+    output logic                      extend,
+    // Configuration
+    input  logic [FRACTION_WIDTH-1:0] baud_fraction
+);
+
+  logic [FRACTION_WIDTH-1:0] accumulator;
+  logic [  FRACTION_WIDTH:0] sum;
+
+  // The carry of this bit's addition extends it
+  assign sum = {1'b0, accumulator} + {1'b0, baud_fraction};
+  assign extend = sum[FRACTION_WIDTH];
+
+  always_ff @(posedge clk or posedge rst) begin : accumulate
+    if (rst) begin
+      accumulator <= 0;
+    end else if (restart) begin
+      accumulator <= 0;
+    end else if (bit_end) begin
+      accumulator <= sum[FRACTION_WIDTH-1:0];
+    end
+  end
+
+endmodule
@@ -1,56 +1,78 @@
-module uart_buffered_rx (
+`timescale 1us / 1ns
+
+// Description: UART receiver with a FIFO buffer. Received bytes are pushed
+//              into the buffer, which is read like `fifo_simple`: `data` is
+//              valid within the cycle `re` is asserted, as long as the buffer
+//              is not empty. Bytes received while the buffer is full are
+//              discarded, which is signaled by a single cycle `overrun`.
+module uart_buffered_rx #(
+    parameter int BUFFER_DEPTH = 64
+) (
     // System
-    input logic         clk,
-    input logic         rst,
+    input  logic                          clk,
+    input  logic                          rst,
     // Data
-    output logic         valid,
-    output logic   [7:0] data,
-    output logic         buffer_empty,
-    output logic         buffer_full,
-    // Uart
-    output logic        rx,
+    input  logic                          re,
+    output logic [                   7:0] data,
+    output logic [$clog2(BUFFER_DEPTH):0] buffer_entries,
+    output logic                          buffer_empty,
+    output logic                          buffer_full,
+    output logic                          overrun,
+    // Uart RX
+    input  logic                          rx,
+    output logic                          error,
     // Configuration
-    output logic        error,
-    input logic  [11:0] baud_divider,
-    input logic         parity_en,
-    input logic         parity_type_odd
+    input  logic [                  11:0] baud_divider,
+    input  logic [                   3:0] baud_fraction,
+    input  logic                          parity_en,
+    input  logic                          parity_type_odd,
+    input  logic                          two_stop_bits
 );
 
-    logic uart_busy, buffer_re;
-    logic [7:0] buffer_2_uart;
-    assign ack = we && ~buffer_full;
-    assign buffer_re = ~buffer_empty && ~uart_busy;
+  logic uart_valid;
+  logic [7:0] uart_2_buffer;
 
-    fifo fifo_tx (
-        // System
-        .clk_write(clk),
-        .clk_read(clk),
-        .rst(rst),
-        // <<<< Write Port >>>>
-        .we(ack),
-        .din(wb_dat_i),
-        .full(buffer_full),
-        // <<<< Read Port >>>>
-        .re(buffer_re),
-        .dout(buffer_2_uart),
-        .empty(buffer_empty)
-    );
+  // A simultaneous read frees a slot of a full buffer
+  assign overrun = uart_valid && buffer_full && !re;
 
-    uart_tx tx (
-        // System
-        .clk(clk),
-        .rst(rst),
-        // Data
-        .start(Buffer_re),
-        .data(buffer_2_uart),
-        .busy(uart_busy),
-        // Uart TX
-        .tx(tx),
-        // Configuration
-        .baud_divider(baud_divider),
-        .parity_en(parity_en),
-        .parity_type_odd(parity_type_odd)
-    );
+  uart_rx uart_rx_mod (
+      // <<< System >>>
+      .clk(clk),
+      .rst(rst),
+      // <<< Data >>>
+      .valid_data(uart_valid),
+      .data(uart_2_buffer),
+      .busy(),
+      .error_detected(error),
+      // <<< Uart RX >>>
+      .rx(rx),
+      // <<< Configuration >>>
+      .baud_divider(baud_divider),
+      .baud_fraction(baud_fraction),
+      .parity_en(parity_en),
+      .parity_type_odd(parity_type_odd),
+      .two_stop_bits(two_stop_bits)
+  );
 
-endmodule
+  fifo_simple #(
+      .DEPTH(BUFFER_DEPTH),
+      .DATA_WIDTH(8)
+  ) fifo (
+      // <<< System >>>
+      .clk(clk),
+      .rst(rst),
+      // <<< Write Port >>>
+      .we(uart_valid),
+      .din(uart_2_buffer),
+      // <<< Read Port >>>
+      .re(re),
+      .dout(data),
+      // <<< Status >>>
+      .entries(buffer_entries),
+      .full(buffer_full),
+      .empty(buffer_empty),
+      .almost_full(),
+      .almost_empty()
+  );
 
+endmodule
@@ -1,4 +1,163 @@
 import cocotb
-from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, FallingEdge, Timer
-# from helper import uart
+import numpy as np
+import pytest
+from cocotb.triggers import RisingEdge, FallingEdge, ClockCycles
+from cocotb.utils import get_sim_time
+from helper import uart
+from tb import coverage, fixtures, runner, stimulus, watchdog
+from tb.timing import UartTiming
+
+# Streaming at full baud, fast enough to keep the benches short
+BAUD: int = 2_000_000
+
+
+def cover(dut) -> None:
+    """Receiver states and buffer occupancy, see `tb.coverage`"""
+    coverage.fsm(dut.clk, dut.uart_rx_mod.state, uart.RX_STATES,
+                 uart.RX_TRANSITIONS)
+    coverage.occupancy(dut.clk, dut.buffer_entries, dut.BUFFER_DEPTH.value)
+
+
+def configure(dut, uart_timing: UartTiming, parity: bool = False) -> None:
+    """Sets default values for the module"""
+    dut.rst.value = 0
+    dut.re.value = 0
+    dut.rx.value = 1
+
+    dut.baud_divider.value = uart_timing.divider
+    dut.baud_fraction.value = uart_timing.fraction
+    dut.parity_en.value = 1 if parity else 0
+    dut.parity_type_odd.value = 0
+    dut.two_stop_bits.value = 0
+
+
+class OverrunCounter:
+    """Counts bytes discarded by the full buffer, until stopped"""
+
+    def __init__(self, dut):
+        self.overrun = dut.overrun
+        self.count = 0
+        self._task = cocotb.start_soon(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await RisingEdge(self.overrun)
+            self.count += 1
+
+    def stop(self) -> None:
+        self._task.kill()
+
+
+def stream(dut, uart_timing: UartTiming, values: np.ndarray):
+    """Sends all values as back-to-back frames"""
+    frames = stimulus.uart_frames(values)
+    return cocotb.start_soon(
+        uart.send_frame(dut, uart_timing.divider, frames.ravel().tolist(),
+                        clk_period_ps=uart_timing.clk_period_ps)
+    )
+
+
+@cocotb.test()
+async def sustained_throughput(dut):
+    """Back-to-back frames at full baud with an always ready consumer"""
+    uart_timing = UartTiming(BAUD)
+
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+    cover(dut)
+
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
+    overruns = OverrunCounter(dut)
+
+    NUM_BYTES: int = 256
+    line_rate = uart_timing.clk_hz / uart_timing.frame_cycles()
+    values = stimulus.random_data(stimulus.rng(), NUM_BYTES, 8)
+
+    sender = stream(dut, uart_timing, values)
+    await watchdog.wait(dut, FallingEdge(dut.buffer_empty),
+                        2 * uart_timing.frame_cycles(),
+                        "First frame should be buffered")
+    start = get_sim_time("ns")
+    read = await uart.read_buffer(dut, NUM_BYTES)
+    elapsed_ns = get_sim_time("ns") - start
+    await sender
+    overruns.stop()
+
+    # Without the first byte, whose frame precedes the measurement
+    throughput = (NUM_BYTES - 1) / (elapsed_ns * 1e-9)
+    dut._log.info("Receive throughput: %.0f B/s (line rate: %.0f B/s)",
+                  throughput, line_rate)
+
+    assert values.tolist() == read, "Sent data does not match received data"
+    assert 0 == overruns.count, "No byte is discarded"
+    assert 0 == dut.error.value, "No framing error"
+    assert throughput > 0.95 * line_rate, "Bytes are received at line rate"
+
+
+@cocotb.test()
+async def stalled_consumer(dut):
+    """Measures how many bytes the buffer absorbs while the consumer stalls"""
+    uart_timing = UartTiming(BAUD)
+
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+    cover(dut)
+
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
+    overruns = OverrunCounter(dut)
+
+    EXCESS_BYTES: int = 8
+    capacity = dut.BUFFER_DEPTH.value
+    values = stimulus.random_data(stimulus.rng(), capacity + EXCESS_BYTES, 8)
+
+    start = get_sim_time("ns")
+    sender = stream(dut, uart_timing, values)
+    await watchdog.wait(dut, RisingEdge(dut.buffer_full),
+                        (capacity + 1) * uart_timing.frame_cycles(),
+                        "Buffer should fill up")
+    absorbed = dut.buffer_entries.value.integer
+    elapsed_us = (get_sim_time("ns") - start) / 1000
+    await sender
+    await ClockCycles(dut.clk, uart_timing.bit_cycles)
+    overruns.stop()
+
+    dut._log.info("Buffer of depth %d absorbed %d bytes (%.1f us at %d baud) "
+                  "before buffer_full, %d bytes were discarded",
+                  dut.BUFFER_DEPTH.value, absorbed, elapsed_us, BAUD,
+                  overruns.count)
+
+    assert capacity == absorbed, "Buffer absorbs bytes up to its capacity"
+    assert EXCESS_BYTES == overruns.count, "Each excess byte is an overrun"
+
+    # The oldest bytes are kept, in order
+    read = await uart.read_buffer(dut, absorbed)
+    assert values[:absorbed].tolist() == read, "Buffered data is intact"
+    await FallingEdge(dut.clk)
+    assert 1 == dut.buffer_empty.value, "Empty after draining"
+
+
+PARAMETERS = runner.parameter_matrix(BUFFER_DEPTH=[16, 64])
+
+
+@pytest.mark.parametrize("parameters", PARAMETERS, ids=runner.parameter_id)
+def test_runner(parameters, testcase):
+    from pathlib import Path
+
+    hdl_toplevel = "uart_buffered_rx"
+    project_path = Path(__file__).resolve().parent
+
+    verilog_sources = [
+        project_path / f"{hdl_toplevel}.sv",
+        project_path / "uart_rx.sv",
+        project_path / "uart_baud_fraction.sv",
+        project_path / "../../memory/fifo/fifo_simple.sv",
+        project_path / "../../memory/ram/ram_partial_dp_scd.sv",
+    ]
+
+    runner.run(hdl_toplevel, verilog_sources, parameters=parameters,
+               testcase=testcase)
+
+
+if __name__ == "__main__":
+    for parameters in PARAMETERS:
+        test_runner(parameters, testcase=None)
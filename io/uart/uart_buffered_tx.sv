@@ -13,17 +13,17 @@ module uart_buffered_tx (
     output logic        tx,
     // Configuration
     input  logic [11:0] baud_divider,
+    input  logic [ 3:0] baud_fraction,
     input  logic        parity_en,
-    input  logic        parity_type_odd
+    input  logic        parity_type_odd,
+    input  logic        two_stop_bits
 );
 
-  logic uart_busy, buffer_re, buffer_we;
+  logic uart_ready, buffer_re, buffer_we;
   logic [7:0] buffer_2_uart;
-  logic just_issued_cmd;
 
-
-
-  assign buffer_re = !buffer_empty && !uart_busy;
+  // The next byte is handed over during the stop bit -> No gap between frames
+  assign buffer_re = !buffer_empty && uart_ready;
   assign buffer_we = we && !buffer_full;
 
   fifo_simple fifo (
@@ -37,8 +37,11 @@ module uart_buffered_tx (
       .re(buffer_re),
       .dout(buffer_2_uart),
       // <<< Status >>>
+      .entries(),
       .full(buffer_full),
-      .empty(buffer_empty)
+      .empty(buffer_empty),
+      .almost_full(),
+      .almost_empty()
   );
 
   uart_tx uart_tx_mod (
@@ -48,13 +51,16 @@ module uart_buffered_tx (
       // <<< Data >>>
       .start(buffer_re),
       .data(buffer_2_uart),
-      .busy(uart_busy),
+      .busy(),
+      .ready(uart_ready),
       // <<< Uart TX >>>
       .tx(tx),
       // <<< Configuration >>>
       .baud_divider(baud_divider),
+      .baud_fraction(baud_fraction),
       .parity_en(parity_en),
-      .parity_type_odd(parity_type_odd)
+      .parity_type_odd(parity_type_odd),
+      .two_stop_bits(two_stop_bits)
   );
 
 endmodule
@@ -1,157 +1,120 @@
 import cocotb
-from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, FallingEdge, Timer
+import numpy as np
+from cocotb.regression import TestFactory
+from cocotb.triggers import RisingEdge
+from helper import uart
+from tb import fixtures, stimulus, watchdog
+from tb.timing import UartTiming
 
+# Fast links, down to stop bits of two and three clock cycles
+BAUDS = [2_000_000, 16_666_667, 25_000_000]
 
-async def reset_dut(dut):
-    # For a nicer trace
-    await RisingEdge(dut.clk)
-    dut.rst.value = 1
-    await RisingEdge(dut.clk)
-    dut.rst.value = 0
-    await RisingEdge(dut.clk)
 
-
-def configure(dut, baud: int, freq: float, parity: bool = False) -> None:
+def configure(dut, uart_timing: UartTiming, parity: bool = False) -> None:
     """Sets default values for the module"""
     dut.rst.value = 0
     dut.we.value = 0
 
-    dut.baud_divider.value = int(freq / baud)
+    dut.baud_divider.value = uart_timing.divider
+    dut.baud_fraction.value = uart_timing.fraction
     dut.parity_en.value = 1 if parity else 0
     dut.parity_type_odd.value = 0
+    dut.two_stop_bits.value = 0
 
 
-# TODO: Copied from uart_tx.py -> Refactor
-async def receive_symbol(dut, baud: int, bits=8,
-                         parity=False, parity_odd=False):
-
-    # async def receive():
-    cycle = 1. / float(baud)
-    time_half_bit = Timer(int(cycle * 1e9 / 2.), 'ns')
-    time_bit = Timer(int(cycle * 1e9), 'ns')
-
-    value = 0
-
-    # Wait for start
-    await FallingEdge(dut.tx)
+@cocotb.test()
+async def send_bytes(dut):
+    uart_timing = UartTiming()
+    # Below not in sync with `configure`
+    bits = 8
+    parity = False
+    parity_odd = True
 
-    # Start bit
-    await time_half_bit
-    assert 0 == dut.tx.value, "Start bit is invalid"
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
 
-    # Data bits
-    parity_bit = 0
-    for i in range(bits):
-        await time_bit
-        data_bit = dut.tx.value & 1
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
 
-        value |= data_bit << i
-        parity_bit ^= data_bit
+    NUM_BYTES: int = 256
+    watchdog.budget(2 * NUM_BYTES * uart_timing.frame_cycles(bits))
 
-    # Parity bit
-    if parity is True:
-        await time_bit
-        data_bit = dut.tx.value & 1
+    monitor = uart.UartMonitor(dut.clk, dut.tx, uart_timing.divider, bits,
+                               parity, parity_odd,
+                               clk_period_ps=uart_timing.clk_period_ps)
+    monitor.start()
 
-        parity_bit = ~parity_bit if parity_odd else parity_bit
-        assert parity_bit == data_bit, "Parity does not match!"
+    wrote = bytes((i + 1) % 255 for i in range(NUM_BYTES))
+    task_r = cocotb.start_soon(monitor.read_bytes(NUM_BYTES))
+    await uart.write_buffer(dut, wrote)
+    read = await task_r
 
-    # Stop bit
-    await time_bit
-    assert dut.tx.value == 1, "Stop bit is invalid"
+    await RisingEdge(dut.clk)
+    monitor.stop()
 
-    # self.log.info("Read byte 0x%02x", b)
-    return value
+    assert list(wrote) == read
 
 
-@cocotb.test()
-async def send_bytes(dut):
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / 50e6)
-    baud = 115200
-    # Below not in sync with `configure`
+async def bulk_write_throughput(dut, baud: int):
+    """
+    Streams a large payload at line rate through the FIFO, without gaps
+    between the frames
+    """
+    uart_timing = UartTiming(baud)
     bits = 8
-    parity = False
-    parity_odd = True
 
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns")
-                      .start())
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
 
-    configure(dut, baud, clk_freq)
-    await reset_dut(dut)
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
 
-    # TODO: Impl test
+    NUM_BYTES: int = 1024
+    watchdog.budget(2 * NUM_BYTES * uart_timing.frame_cycles(bits))
+    line_rate = uart_timing.clk_hz / uart_timing.frame_cycles(bits)
 
-    NUM_BYTES: int = 256
+    monitor = uart.UartMonitor(dut.clk, dut.tx, uart_timing.divider, bits,
+                               clk_period_ps=uart_timing.clk_period_ps)
+    monitor.start()
 
-    async def write_byte(v: int) -> None:
-        await Timer(1, "ns")  # Wait for combinatorial of `buffer_full`
-        if dut.buffer_full.value == 1:
-            await FallingEdge(dut.buffer_full)
-        dut.data.value = v
-        dut.we.value = 1
-        await RisingEdge(dut.clk)
-        dut.we.value = 0
-
-    async def write_bytes() -> list[int]:
-        bytes = []
-        for i in range(NUM_BYTES):
-            byte = (i + 1) % 255
-            await write_byte(byte)
-            bytes.append(byte)
-
-        return bytes
-
-    async def receive_bytes() -> list[int]:
-        bytes = []
-        for _ in range(NUM_BYTES):
-            byte = await receive_symbol(dut, baud, bits,
-                                        parity, parity_odd)
-            bytes.append(byte)
-        return bytes
-
-    task_r = cocotb.start_soon(receive_bytes())
-    task_w = cocotb.start_soon(write_bytes())
-
-    wrote = await task_w
+    payload = stimulus.random_data(stimulus.rng(), NUM_BYTES, bits) \
+        .astype(np.uint8)
+    task_r = cocotb.start_soon(monitor.read_bytes(NUM_BYTES))
+    throughput = await uart.write_buffer(dut, payload)
     read = await task_r
+    monitor.stop()
+
+    # The first frame starts before the FIFO fills
+    gaps = np.array(monitor.gaps(uart_timing.frame_cycles(bits),
+                                 uart_timing.clk_period_ps)[1:])
+    dut._log.info("Write throughput: %.0f B/s (line rate: %.0f B/s), "
+                  "gap between frames: %d-%d cycles", throughput, line_rate,
+                  gaps.min(), gaps.max())
+    assert payload.tolist() == read, "Sent data does not match received data"
+    assert throughput > 0.9 * line_rate, "FIFO is drained at line rate"
+    assert not gaps.any(), "Frames are sent back-to-back"
 
-    await RisingEdge(dut.clk)
 
-    assert wrote == read
+factory = TestFactory(bulk_write_throughput)
+factory.add_option("baud", BAUDS)
+factory.generate_tests()
 
 
-def test_runner():
-    import os
+def test_runner(testcase):
     from pathlib import Path
-    from cocotb.runner import get_runner
+    from tb import runner
 
     hdl_toplevel = "uart_buffered_tx"
-    sim = os.getenv("SIM", "verilator")
     project_path = Path(__file__).resolve().parent
 
     verilog_sources = [
         project_path / f"{hdl_toplevel}.sv",
         project_path / "uart_tx.sv",
+        project_path / "uart_baud_fraction.sv",
         project_path / "../../memory/fifo/fifo_simple.sv",
         project_path / "../../memory/ram/ram_partial_dp_scd.sv",
     ]
 
-    build_args = ["--trace", "--trace-structs"] if sim == "verilator" else []
-    runner = get_runner(sim)
-    runner.build(
-        verilog_sources=verilog_sources,
-        vhdl_sources=[],
-        hdl_toplevel=hdl_toplevel,
-        always=True,
-        build_args=build_args,
-        build_dir=f"build/{hdl_toplevel}",
-    )
-
-    runner.test(hdl_toplevel=hdl_toplevel, test_module=f"{hdl_toplevel}_test,",
-                waves=True, extra_env={"WAVES": "1"})
+    runner.run(hdl_toplevel, verilog_sources, testcase=testcase)
 
 
 if __name__ == "__main__":
-    test_runner()
+    test_runner(testcase=None)
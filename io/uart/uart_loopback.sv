@@ -0,0 +1,69 @@
+`timescale 1us / 1ns
+
+// Description: Loopback of `uart_buffered_tx` into `uart_rx` over `line`, for
+//              system tests of both ends. Bytes are written like into
+//              `uart_buffered_tx` and received like from `uart_rx`. Both ends
+//              share the clock and configuration.
+module uart_loopback (
+    // System
+    input  logic        clk,
+    input  logic        rst,
+    // Transmitter
+    input  logic        we,
+    input  logic [ 7:0] data,
+    output logic        buffer_empty,
+    output logic        buffer_full,
+    // Receiver
+    output logic        rx_valid,
+    output logic [ 7:0] rx_data,
+    output logic        rx_busy,
+    output logic        rx_error,
+    // Uart
+    output logic        line,
+    // Configuration
+    input  logic [11:0] baud_divider,
+    input  logic [ 3:0] baud_fraction,
+    input  logic        parity_en,
+    input  logic        parity_type_odd,
+    input  logic        two_stop_bits
+);
+
+  uart_buffered_tx transmitter (
+      // <<< System >>>
+      .clk(clk),
+      .rst(rst),
+      // <<< Data >>>
+      .we(we),
+      .data(data),
+      .buffer_empty(buffer_empty),
+      .buffer_full(buffer_full),
+      // <<< Uart TX >>>
+      .tx(line),
+      // <<< Configuration >>>
+      .baud_divider(baud_divider),
+      .baud_fraction(baud_fraction),
+      .parity_en(parity_en),
+      .parity_type_odd(parity_type_odd),
+      .two_stop_bits(two_stop_bits)
+  );
+
+  uart_rx receiver (
+      // <<< System >>>
+      .clk(clk),
+      .rst(rst),
+      // <<< Data >>>
+      .valid_data(rx_valid),
+      .data(rx_data),
+      .busy(rx_busy),
+      .error_detected(rx_error),
+      // <<< Uart RX >>>
+      .rx(line),
+      // <<< Configuration >>>
+      .baud_divider(baud_divider),
+      .baud_fraction(baud_fraction),
+      .parity_en(parity_en),
+      .parity_type_odd(parity_type_odd),
+      .two_stop_bits(two_stop_bits)
+  );
+
+endmodule
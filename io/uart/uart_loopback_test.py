@@ -0,0 +1,116 @@
+import os
+
+import cocotb
+import numpy as np
+from cocotb.regression import TestFactory
+from cocotb.triggers import ClockCycles, FallingEdge, RisingEdge
+from cocotb.utils import get_sim_time
+from helper import uart
+from tb import fixtures, stimulus, watchdog
+from tb.timing import UartTiming
+
+# Baud rates of deployed links
+BAUDS = [115_200, 921_600, 3_125_000]
+
+
+def configure(dut, uart_timing: UartTiming, parity: bool = False) -> None:
+    """Sets default values for the module"""
+    dut.rst.value = 0
+    dut.we.value = 0
+
+    dut.baud_divider.value = uart_timing.divider
+    dut.baud_fraction.value = uart_timing.fraction
+    dut.parity_en.value = 1 if parity else 0
+    dut.parity_type_odd.value = 0
+    dut.two_stop_bits.value = 0
+
+
+async def latency_ns(dut) -> float:
+    """Time from writing a byte into the idle link until it is received"""
+    await FallingEdge(dut.clk)
+    dut.data.value = 0xA5
+    dut.we.value = 1
+    start = get_sim_time("ns")
+    await FallingEdge(dut.clk)
+    dut.we.value = 0
+    await watchdog.wait(
+        dut, RisingEdge(dut.rx_valid),
+        2 * uart.frame_cycles(dut.baud_divider.value.integer),
+        "Byte should be looped back")
+    assert 0xA5 == dut.rx_data.value, "Received byte matches"
+    return get_sim_time("ns") - start
+
+
+async def line_rate(dut, baud: int):
+    """
+    End-to-end latency and throughput at `baud`. The payload spans about
+    `CYCLES` clock cycles, e.g. `CYCLES=200000000` sends megabytes
+    """
+    uart_timing = UartTiming(baud)
+    bits = 8
+
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
+
+    frame_cycles = uart_timing.frame_cycles(bits)
+    latency = await latency_ns(dut)
+    await ClockCycles(dut.clk, uart_timing.bit_cycles)
+
+    cycles = int(os.getenv("CYCLES", "1000000"))
+    watchdog.budget(2 * cycles)
+    payload = stimulus.random_data(stimulus.rng(), cycles // frame_cycles,
+                                   bits).astype(np.uint8)
+    receiver = cocotb.start_soon(
+        uart.read_valid(dut.rx_valid, dut.rx_data, len(payload)))
+    start = get_sim_time("ns")
+    await uart.write_buffer(dut, payload)
+    read = await receiver
+    elapsed_ns = get_sim_time("ns") - start
+
+    throughput = len(payload) / (elapsed_ns * 1e-9)
+    line_rate_bytes_per_s = uart_timing.clk_hz / frame_cycles
+    latency_cycles = latency * uart_timing.clk_hz * 1e-9
+    dut._log.info("%d baud: %d bytes at %.0f B/s (line rate: %.0f B/s), "
+                  "latency %.2f us = %.0f cycles (frame: %d cycles)",
+                  baud, len(payload), throughput, line_rate_bytes_per_s,
+                  latency / 1000, latency_cycles, frame_cycles)
+
+    assert payload.tolist() == read, "Sent data does not match received data"
+    assert 0 == dut.rx_error.value, "No framing error"
+    assert throughput > 0.9 * line_rate_bytes_per_s, \
+        "Bytes are looped back at line rate"
+    assert latency_cycles < 2 * frame_cycles, \
+        "A byte arrives within about a frame"
+
+    await ClockCycles(dut.clk, uart_timing.bit_cycles)
+
+
+factory = TestFactory(line_rate)
+factory.add_option("baud", BAUDS)
+factory.generate_tests()
+
+
+def test_runner(testcase):
+    from pathlib import Path
+    from tb import runner
+
+    hdl_toplevel = "uart_loopback"
+    project_path = Path(__file__).resolve().parent
+
+    verilog_sources = [
+        project_path / f"{hdl_toplevel}.sv",
+        project_path / "uart_buffered_tx.sv",
+        project_path / "uart_tx.sv",
+        project_path / "uart_rx.sv",
+        project_path / "uart_baud_fraction.sv",
+        project_path / "../../memory/fifo/fifo_simple.sv",
+        project_path / "../../memory/ram/ram_partial_dp_scd.sv",
+    ]
+
+    runner.run(hdl_toplevel, verilog_sources, testcase=testcase)
+
+
+if __name__ == "__main__":
+    test_runner(testcase=None)
@@ -3,33 +3,54 @@
 // Author: David B. <initials_same_order_seperated_with_dot@nsch.at>
 // Description: Simple UART receiver with runtime settings (except for data)
 //              Allows BAUD of 9600 at 50MHz and much faster settings.
-//              Single stop bit between transfers. Inputs are registered at
-//              next posedge of clk if not busy. `valid_data` is only asserted
-//              for a singly clock cycle. `error_detected?` is asserted until
-//              resolved, but never more than once per transfer.
-// Notes: Generic `DATA_WIDTH` is not yet implemented and must stay unaltered.
+//              `DATA_WIDTH` of 5 to 9 bits and one or two stop bits
+//              (`two_stop_bits`), which must all be valid. Inputs are
+//              registered at next posedge of clk if not busy. `valid_data`
+//              is only asserted for a singly clock cycle. `error_detected?`
+//              is asserted until resolved, but never more than once per
+//              transfer.
+//              A bit lasts `baud_divider + 1 + baud_fraction / 16` clock
+//              cycles on average, see `uart_baud_fraction`.
+//              Each bit is sampled `OVERSAMPLING` times and decided by the
+//              majority of the `VOTES` samples around its centre, which
+//              suppresses glitches. Likewise, a start bit must last longer
+//              than the distance of two samples. `VOTES = 1` and bits shorter
+//              than `OVERSAMPLING` cycles sample only the centre.
 module uart_rx (
     // System
-    input logic                   clk,
-    input logic                   rst,
+    input logic                       clk,
+    input logic                       rst,
     // Data
-    output logic                  valid_data,
-    output logic [DATA_WIDTH-1:0] data,
-    output logic                  busy,
-    output logic                  error_detected,
+    output logic                      valid_data,
+    output logic [    DATA_WIDTH-1:0] data,
+    output logic                      busy,
+    output logic                      error_detected,
     // Uart
-    input logic                   rx,
+    input logic                       rx,
     // Configuration
-    input logic  [BAUD_WIDTH-1:0] baud_divider,
-    input logic                   parity_en,
-    input logic                   parity_type_odd
+    input logic  [    BAUD_WIDTH-1:0] baud_divider,
+    input logic  [FRACTION_WIDTH-1:0] baud_fraction,
+    input logic                       parity_en,
+    input logic                       parity_type_odd,
+    input logic                       two_stop_bits
 );
     // ╭───────────────────────────────────────────────────────────────────────╮
     // │                               Parameters                              │
     // ╰───────────────────────────────────────────────────────────────────────╯
-    // TODO: Parity check not yet implemented!
     parameter int DATA_WIDTH = 8;
     parameter int BAUD_WIDTH = 12;
+    parameter int FRACTION_WIDTH = 4;
+    // Samples per bit (power of two) and odd number of centre samples voting
+    parameter int OVERSAMPLING = 16;
+    parameter int VOTES = 3;
+
+    // Samples are `>> $clog2(OVERSAMPLING)` apart and the majority needs no ties
+    if (OVERSAMPLING < 1 || (OVERSAMPLING & (OVERSAMPLING - 1)) != 0) begin : check_oversampling
+        $error("OVERSAMPLING must be a power of two, got %0d", OVERSAMPLING);
+    end
+    if (VOTES < 1 || VOTES % 2 == 0 || VOTES > OVERSAMPLING) begin : check_votes
+        $error("VOTES must be odd and at most OVERSAMPLING, got %0d", VOTES);
+    end
 
     // ╭───────────────────────────────────────────────────────────────────────╮
     // │                                 Types                                 │
@@ -53,23 +74,57 @@ module uart_rx (
     logic [$clog2(DATA_WIDTH):0] bit_position;
     logic                        parity_bit, parity_bit_even;
     logic       [DATA_WIDTH-1:0] data_buffer;
-    logic       [BAUD_WIDTH-1:0] baud_counter;
-    logic       [BAUD_WIDTH-1:0] baud_divider_reference;
+    // One more than the divider for extended bits
+    logic         [BAUD_WIDTH:0] baud_counter;
+    logic         [BAUD_WIDTH:0] baud_divider_reference;
+    logic         [BAUD_WIDTH:0] baud_limit;
+    logic                        baud_extend;
+    // Majority vote
+    logic         [BAUD_WIDTH:0] sample_step;
+    logic         [BAUD_WIDTH:0] vote_delay;
+    logic         [BAUD_WIDTH:0] start_filter;
+    logic                        sample;
+    logic  [$clog2(VOTES+1)-1:0] votes;
+    logic                        rx_bit;
+    // First of two stop bits
+    logic                        extra_stop_bit;
 
     // Registered inputs
-    logic                  rx_registered;
-    logic [BAUD_WIDTH-1:0] baud_divider_registered;
-    logic                  parity_en_registered;
-    logic                  parity_type_odd_registered;
+    logic                      rx_registered;
+    logic [    BAUD_WIDTH-1:0] baud_divider_registered;
+    logic [FRACTION_WIDTH-1:0] baud_fraction_registered;
+    logic                      parity_en_registered;
+    logic                      parity_type_odd_registered;
+    logic                      two_stop_bits_registered;
 
     // ╭───────────────────────────────────────────────────────────────────────╮
     // │                              Assignments                              │
     // ╰───────────────────────────────────────────────────────────────────────╯
     assign parity_bit     = (parity_type_odd_registered) ? ~parity_bit_even : parity_bit_even;
     assign error_detected = (state == ERROR);
-    assign data           = (valid_data) ? data_buffer : 8'h0;
+    assign data           = (valid_data) ? data_buffer : '0;
+    assign baud_limit     = {1'b0, baud_divider_registered} + (BAUD_WIDTH+1)'(baud_extend);
+    // Bits are decided at their last sample, `VOTES / 2` steps after the centre
+    // The start bit is entered `start_filter` cycles after its falling edge
     assign baud_divider_reference = (state != START_BIT)
-                                  ? baud_divider_registered : baud_divider_registered >> 1;
+                                  ? baud_limit
+                                  : {1'b0, baud_divider_registered >> 1} + vote_delay - start_filter;
+    // Zero for bits shorter than `OVERSAMPLING` cycles
+    assign sample_step  = ({1'b0, baud_divider_registered} + 1) >> $clog2(OVERSAMPLING);
+    assign vote_delay   = (BAUD_WIDTH+1)'(VOTES / 2) * sample_step;
+    assign start_filter = (VOTES > 1) ? sample_step : 0;
+    // Majority of the previous votes and the current sample
+    assign rx_bit = (sample_step == 0)
+                  ? rx_registered
+                  : (votes + $bits(votes)'(rx_registered)) > $bits(votes)'(VOTES / 2);
+
+    always_comb begin : sample_points
+        sample = 0;
+        for (int k = 0; k < VOTES; k++) begin
+            sample |= (baud_counter + (BAUD_WIDTH+1)'(k) * sample_step
+                       == baud_divider_reference);
+        end
+    end
 
     // ╭───────────────────────────────────────────────────────────────────────╮
     // │                                 Logic                                 │
@@ -77,8 +132,10 @@ module uart_rx (
     always_ff @(posedge clk) begin : register_inputs
       if( ~busy ) begin
         baud_divider_registered <= baud_divider;
+        baud_fraction_registered <= baud_fraction;
         parity_en_registered <= parity_en;
         parity_type_odd_registered <= parity_type_odd;
+        two_stop_bits_registered <= two_stop_bits;
       end
     end
 
@@ -111,15 +168,16 @@ module uart_rx (
     always_comb begin : next_state_and_busy
         case (state)
             IDLE: begin
-                next_state = (rx_registered === 0) ? START_BIT : IDLE;
+                next_state = (rx_registered === 0 && baud_counter == start_filter)
+                           ? START_BIT : IDLE;
                 busy = 0;
             end
             START_BIT: begin
-                next_state = (rx_registered === 0) ? DATA_BITS : ERROR;
+                next_state = (rx_bit === 0) ? DATA_BITS : ERROR;
                 busy = 1;
             end
             DATA_BITS: begin
-                if(bit_position >= 4'(DATA_WIDTH - 1)) begin
+                if(bit_position >= $bits(bit_position)'(DATA_WIDTH - 1)) begin
                   next_state = (parity_en_registered === 1) ? PARITY_BIT : STOP_BIT;
                 end else begin
                   next_state = DATA_BITS;
@@ -127,13 +185,16 @@ module uart_rx (
                 busy = 1;
             end
             PARITY_BIT: begin
-                next_state = (parity_bit !== rx_registered) ? ERROR : STOP_BIT;
+                next_state = (parity_bit !== rx_bit) ? ERROR : STOP_BIT;
                 busy = 1;
             end
-            // Same as IDLE
             STOP_BIT: begin
-                next_state = (rx_registered === 0) ? ERROR : IDLE;
-                busy = ~valid_data;
+                if (rx_bit === 0) begin
+                  next_state = ERROR;
+                end else begin
+                  next_state = (extra_stop_bit) ? STOP_BIT : IDLE;
+                end
+                busy = 1;
             end
             ERROR: begin
                 next_state = (rx_registered === 0) ? ERROR : IDLE;
@@ -153,11 +214,10 @@ module uart_rx (
         end else if (state === IDLE) begin
             valid_data <= 0;
         end else if (state === STOP_BIT && !error_detected) begin
-            // Only during the transition STOP_BIT -> IDLE, as the transaction
+            // Only with the transition STOP_BIT -> IDLE, as the transaction
             // could be invalid
-            valid_data <= (state === STOP_BIT)
-                       && (next_state === IDLE)
-                       && (baud_counter == baud_divider_registered-1);
+            valid_data <= (next_state === IDLE)
+                       && (baud_counter == baud_divider_reference);
         end else begin
           valid_data <= 0;
         end
@@ -167,9 +227,17 @@ module uart_rx (
         if (rst) begin
             baud_counter <= 0;
         end else if (state === IDLE) begin
+            // Duration of a low line, until it is a start bit
+            baud_counter <= (rx_registered === 0 && next_state === IDLE)
+                          ? baud_counter + 1 : 0;
+        end else if (state === ERROR) begin
+            baud_counter <= 0;
+        end else if (state === START_BIT && baud_counter == baud_divider_reference) begin
+            // Restart at the centre of the start bit, so that all following
+            // bits are sampled at their centre as well
             baud_counter <= 0;
         end else begin
-          if( baud_counter < baud_divider_registered ) begin
+          if( baud_counter < baud_limit ) begin
               baud_counter <= baud_counter + 1;
           end else begin
               baud_counter <= 0;
@@ -177,6 +245,29 @@ module uart_rx (
         end
     end
 
+    always_ff @(posedge clk or posedge rst) begin : stop_bits
+        if (rst) begin
+            extra_stop_bit <= 0;
+        end else if (state !== STOP_BIT) begin
+            extra_stop_bit <= two_stop_bits_registered;
+        end else if (baud_counter == baud_divider_reference) begin
+            extra_stop_bit <= 0;
+        end
+    end
+
+    // Samples of the current bit that are 1, cleared once it is decided
+    always_ff @(posedge clk or posedge rst) begin : vote_counter
+        if (rst) begin
+            votes <= 0;
+        end else if (state === IDLE || state === ERROR) begin
+            votes <= 0;
+        end else if (baud_counter == baud_divider_reference) begin
+            votes <= 0;
+        end else if (sample && rx_registered) begin
+            votes <= votes + 1;
+        end
+    end
+
     always_ff @(posedge clk or posedge rst) begin: data_parity_bit
         if (rst) begin
             data_buffer <= 0;
@@ -186,16 +277,34 @@ module uart_rx (
             data_buffer <= 0;
             parity_bit_even <= 0;
             bit_position <= 0;
-        end else if (state == DATA_BITS && baud_counter == baud_divider_registered) begin
+        end else if (state == DATA_BITS && baud_counter == baud_limit) begin
             data_buffer <= (state == DATA_BITS)
-                           ? {rx_registered, data_buffer[7:1]} : data_buffer;
+                           ? {rx_bit, data_buffer[DATA_WIDTH-1:1]} : data_buffer;
 
             parity_bit_even <= (parity_en_registered && state == DATA_BITS)
-                               ? (parity_bit_even ^ rx_registered) : 1'b0;
+                               ? (parity_bit_even ^ rx_bit) : 1'b0;
 
             bit_position <= (state == DATA_BITS)
                             ? bit_position + 1 : bit_position;
         end
     end
+
+    // ╭───────────────────────────────────────────────────────────────────────╮
+    // │                                Modules                                │
+    // ╰───────────────────────────────────────────────────────────────────────╯
+    // Restarts with the start bit, whose centre aligns the following bits
+    uart_baud_fraction #(
+        .FRACTION_WIDTH(FRACTION_WIDTH)
+    ) baud_fraction_mod (
+        // <<< System >>>
+        .clk(clk),
+        .rst(rst),
+        // <<< Bit timing >>>
+        .restart(state == IDLE || state == START_BIT),
+        .bit_end(baud_counter == baud_limit),
+        .extend(baud_extend),
+        // <<< Configuration >>>
+        .baud_fraction(baud_fraction_registered)
+    );
 endmodule
 
@@ -1,29 +1,51 @@
+from typing import List
+
 import cocotb
-from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, FallingEdge, Timer
+import numpy as np
+import pytest
+from cocotb.regression import TestFactory
+from cocotb.triggers import RisingEdge, FallingEdge, ClockCycles, First
+from cocotb.utils import get_sim_time
 from helper import uart
-
-
-async def reset_dut(dut):
-    await FallingEdge(dut.clk)
-    dut.rst.value = 1
-    await RisingEdge(dut.clk)
-    dut.rst.value = 0
-
-
-def configure(dut, baud: int, freq: float, parity: bool = False) -> None:
+from tb import coverage, fixtures, runner, stimulus, watchdog
+from tb.timing import UartTiming
+
+# Deployed link configurations: Baud rates x (parity enable, odd parity)
+BAUDS = [115_200, 921_600, 3_125_000]
+PARITIES = [(False, False), (True, False), (True, True)]
+STOP_BITS = [1, 2]
+# Standard and high baud rates, most without an integer divider at 50 MHz
+FRACTIONAL_BAUDS = [115_200, 230_400, 921_600, 1_500_000, 3_000_000,
+                    4_000_000]
+# Transmitter clock offsets, edge jitter (peak, in bit periods), share of bits
+# with a glitch and baud rates up to four cycles per bit
+PPMS = [-10_000, 0, 10_000]
+JITTER = 0.1
+GLITCHES = [0, 0.2]
+ROBUSTNESS_BAUDS = [921_600, 2_000_000, 3_000_000, 4_000_000, 5_000_000,
+                    6_250_000, 8_333_333, 12_500_000]
+RELIABLE_BAUD = 3_000_000
+
+
+def configure(dut, uart_timing: UartTiming, parity: bool = False,
+              parity_odd: bool = False, stop_bits: int = 1) -> None:
     """Sets default values for the module"""
     dut.rst.value = 0
-    dut.baud_divider.value = int(freq / baud)
+    dut.baud_divider.value = uart_timing.divider
+    dut.baud_fraction.value = uart_timing.fraction
     dut.parity_en.value = 1 if parity else 0
-    dut.parity_type_odd.value = 0
+    dut.parity_type_odd.value = 1 if parity_odd else 0
+    dut.two_stop_bits.value = 1 if stop_bits == 2 else 0
     dut.rx.value = 1
 
 
 async def wait_until_not_busy(dut) -> None:
     """Returns immediatly if not busy and otherwise waits until it is"""
     if dut.busy.value == 1:
-        await FallingEdge(dut.busy)
+        await watchdog.wait(
+            dut, FallingEdge(dut.busy),
+            uart.frame_cycles(dut.baud_divider.value.integer),
+            "Frame should end")
 
 
 async def receive_valid_byte(dut) -> None:
@@ -34,7 +56,10 @@ async def receive_valid_byte(dut) -> None:
 
     assert dut.valid_data == 0, "No valid data at start"
     assert dut.error_detected == 0, "No error during start"
-    await RisingEdge(dut.valid_data)
+    await watchdog.wait(
+        dut, RisingEdge(dut.valid_data),
+        2 * uart.frame_cycles(dut.baud_divider.value.integer),
+        "Frame should be received")
     assert dut.error_detected == 0, "No error until end"
     await FallingEdge(dut.clk)
     assert dut.busy == 0, "Not busy after completion"
@@ -44,23 +69,25 @@ async def receive_valid_byte(dut) -> None:
 
 @cocotb.test()
 async def send_bytes(dut):
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / 50e6)
-    baud = 115200
+    uart_timing = UartTiming()
     # uart_sink = UartSink(dut.tx, baud=baud, bits=8)
     # Below not in sync with `configure`
-    bits = 8
+    bits = dut.DATA_WIDTH.value
     parity = False
     parity_odd = True
 
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+    coverage.fsm(dut.clk, dut.state, uart.RX_STATES,
+                 uart.RX_TRANSITIONS)
 
-    configure(dut, baud, clk_freq)
-    await reset_dut(dut)
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
+    watchdog.budget(2 * 2**bits * uart_timing.frame_cycles(bits))
 
-    async def send_and_expect(dut, data_tx: int) -> None:
+    async def send_and_expect(dut, data_tx: int, levels: List[int]) -> None:
         task = cocotb.start_soon(
-            uart.send_symbol(dut, baud, data_tx, bits, parity, parity_odd)
+            uart.send_frame(dut, uart_timing.divider, levels,
+                            clk_period_ps=uart_timing.clk_period_ps)
         )
 
         data_rx = await receive_valid_byte(dut)
@@ -69,31 +96,29 @@ async def send_bytes(dut):
 
         assert data_tx == data_rx, "Sent data does not match received data"
 
-    # TODO: Set 256
-    # for v in range(256):
-    for v in range(256):
-        await send_and_expect(dut, v)
+    values = np.arange(2**bits)
+    frames = stimulus.uart_frames(values, bits, parity, parity_odd)
+    for v, levels in zip(values.tolist(), frames.tolist()):
+        await send_and_expect(dut, v, levels)
 
     # For nicer traces:
-    await Timer(int(1./float(baud) * 4 * 1e9), 'ns')
+    await ClockCycles(dut.clk, 4 * uart_timing.bit_cycles)
 
 
 @cocotb.test()
 async def invalid_transaction(dut):
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / 50e6)
-    baud = 115200
-    bits = 8
+    uart_timing = UartTiming()
+    bits = dut.DATA_WIDTH.value
     parity = False
     parity_odd = True
 
-    bit_time_ns = 1./float(baud) * 1e9
-
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+    coverage.fsm(dut.clk, dut.state, uart.RX_STATES,
+                 uart.RX_TRANSITIONS)
 
-    async def stay_low_for(time: float):
-        configure(dut, baud, clk_freq)
-        await reset_dut(dut)
+    async def stay_low_for(cycles: int):
+        configure(dut, uart_timing)
+        await fixtures.reset(dut)
 
         await FallingEdge(dut.clk)
         await FallingEdge(dut.clk)
@@ -102,53 +127,241 @@ async def invalid_transaction(dut):
 
         dut.rx.value = 0
 
-        await Timer(int(time), 'ns')
+        await ClockCycles(dut.clk, cycles)
+
+    frame_cycles = uart_timing.frame_cycles(bits)
 
     # Invalid start bit
-    cocotb.start_soon(stay_low_for(0.2 * bit_time_ns))
-    # TODO: Timeout with error "Invalid start bit should cause error"
-    await RisingEdge(dut.error_detected)
-    await Timer(int(2 * bit_time_ns), 'ns')
+    cocotb.start_soon(stay_low_for(uart_timing.bit_cycles // 5))
+    await watchdog.wait(dut, RisingEdge(dut.error_detected), frame_cycles,
+                        "Invalid start bit should cause error")
+    await ClockCycles(dut.clk, 2 * uart_timing.bit_cycles)
     assert 1 == dut.error_detected.value, "Error persistent while rx reset"
     dut.rx.value = 1
-    await FallingEdge(dut.error_detected)
+    await watchdog.wait(dut, FallingEdge(dut.error_detected), frame_cycles,
+                        "Error should end once rx is idle")
 
     # Invalid stop bit / disconnected
-    cocotb.start_soon(stay_low_for(15. * bit_time_ns))
-    # TODO: Timeout with error "Invalid stop bit should cause error"
-    await RisingEdge(dut.error_detected)
+    cocotb.start_soon(stay_low_for(15 * uart_timing.bit_cycles))
+    await watchdog.wait(dut, RisingEdge(dut.error_detected), 2 * frame_cycles,
+                        "Invalid stop bit should cause error")
     dut.rx.value = 1
-    await FallingEdge(dut.error_detected)
+    await watchdog.wait(dut, FallingEdge(dut.error_detected), frame_cycles,
+                        "Error should end once rx is idle")
 
     # For nicer traces:
-    await Timer(int(1./float(baud) * 4 * 1e9), 'ns')
+    await ClockCycles(dut.clk, 4 * uart_timing.bit_cycles)
+
+
+async def configuration_matrix(dut, baud: int, parity: bool,
+                               parity_odd: bool, stop_bits: int):
+    """
+    Corner and random symbols with one link configuration. With parity, a
+    frame with a flipped parity bit must be rejected and the next one received.
+    """
+    uart_timing = UartTiming(baud)
+    bits = dut.DATA_WIDTH.value
+
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+    coverage.fsm(dut.clk, dut.state, uart.RX_STATES,
+                 uart.RX_TRANSITIONS)
+
+    configure(dut, uart_timing, parity, parity_odd, stop_bits)
+    await fixtures.reset(dut)
+
+    async def send(levels: List[int]) -> None:
+        await uart.send_frame(dut, uart_timing.divider, levels,
+                              clk_period_ps=uart_timing.clk_period_ps)
+
+    values = stimulus.symbols(stimulus.rng(), 64, bits)
+    frames = stimulus.uart_frames(values, bits, parity, parity_odd, stop_bits)
+    values = values.tolist()
+    for v, levels in zip(values, frames.tolist()):
+        task = cocotb.start_soon(send(levels))
+        assert v == await receive_valid_byte(dut), \
+            "Sent data does not match received data"
+        await task
+
+    if not parity:
+        return
+
+    corrupted = frames[0].copy()
+    corrupted[1 + bits] ^= 1
+    task = cocotb.start_soon(send(corrupted.tolist()))
+    fired = await watchdog.wait(
+        dut, First(RisingEdge(dut.error_detected), RisingEdge(dut.valid_data)),
+        2 * uart_timing.frame_cycles(bits, parity, stop_bits),
+        "Frame should end")
+    assert fired is RisingEdge(dut.error_detected), \
+        "Parity error is detected"
+    await task
+    await FallingEdge(dut.clk)
+    assert 0 == dut.error_detected.value, "Error ends with the stop bit"
+
+    task = cocotb.start_soon(send(frames[1].tolist()))
+    assert values[1] == await receive_valid_byte(dut), \
+        "Receives again after a parity error"
+    await task
+
+
+factory = TestFactory(configuration_matrix)
+factory.add_option("baud", BAUDS)
+factory.add_option(("parity", "parity_odd"), PARITIES)
+factory.add_option("stop_bits", STOP_BITS)
+factory.generate_tests()
+
 
+class FrameLog:
+    """Data of all valid frames and times of all errors of `dut`"""
 
-def test_runner():
-    import os
+    def __init__(self, dut):
+        self.received: List[int] = []
+        self.errors: List[float] = []
+        self._tasks = [cocotb.start_soon(self._receive(dut)),
+                       cocotb.start_soon(self._count_errors(dut))]
+
+    async def _receive(self, dut) -> None:
+        while True:
+            await RisingEdge(dut.valid_data)
+            await FallingEdge(dut.clk)
+            self.received.append(dut.data.value.integer)
+
+    async def _count_errors(self, dut) -> None:
+        while True:
+            await RisingEdge(dut.error_detected)
+            self.errors.append(get_sim_time("ns"))
+
+    def failures(self, values: List[int]) -> int:
+        """Errors and sent frames that were not received as sent"""
+        matches = sum(a == b for a, b in zip(values, self.received))
+        return len(self.errors) + len(values) - matches
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.kill()
+
+
+async def bit_period_sweep(dut, baud: int):
+    """
+    Receives back-to-back frames of an ideal transmitter, whose bits last
+    exactly one period of `baud` independent of the clock, with the fractional
+    divider
+    """
+    uart_timing = UartTiming(baud, fractional=True)
+    bits = dut.DATA_WIDTH.value
+    n = 64
+
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+    coverage.fsm(dut.clk, dut.state, uart.RX_STATES,
+                 uart.RX_TRANSITIONS)
+
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
+    watchdog.budget(2 * n * uart_timing.frame_cycles(bits))
+
+    values = stimulus.symbols(stimulus.rng(), n, bits)
+    levels = stimulus.uart_frames(values, bits).ravel().tolist()
+
+    log = FrameLog(dut)
+    await uart.send_frame(dut, uart_timing.divider, levels,
+                          bit_period_ps=uart_timing.ideal_bit_period_ps)
+    await ClockCycles(dut.clk, 2 * uart_timing.bit_cycles)
+    log.stop()
+
+    dut._log.info(f"{uart_timing}: {len(log.received)}/{n} frames received")
+    assert not log.errors, \
+        f"No framing or parity errors, got them at {log.errors} ns"
+    assert values.tolist() == log.received, \
+        "Received data matches the ideal transmitter"
+
+
+factory = TestFactory(bit_period_sweep)
+factory.add_option("baud", FRACTIONAL_BAUDS)
+factory.generate_tests()
+
+
+async def robustness_sweep(dut, ppm: int, glitches: float):
+    """
+    Frames with edge jitter and `glitches` from a transmitter whose clock
+    deviates by `ppm`, at increasing baud rates. Reports the failures per baud
+    rate and the highest baud rate without failures, which must reach
+    `RELIABLE_BAUD`. With glitches, this needs the majority vote as long as
+    bits are oversampled: A single sample must fail at each of these rates.
+    """
+    bits = dut.DATA_WIDTH.value
+    n = 64
+    gen = stimulus.rng()
+    votes = int(dut.VOTES.value)
+    condition = (f"{votes} votes, {ppm:+} ppm, {JITTER:.0%} jitter, "
+                 f"{glitches:.0%} glitches")
+
+    fixtures.start_clock(dut)
+    coverage.fsm(dut.clk, dut.state, uart.RX_STATES,
+                 uart.RX_TRANSITIONS)
+
+    failures = {}
+    for baud in ROBUSTNESS_BAUDS:
+        uart_timing = UartTiming(baud, fractional=True)
+        configure(dut, uart_timing)
+        await fixtures.reset(dut)
+        watchdog.budget(2 * n * uart_timing.frame_cycles(bits))
+
+        values = stimulus.symbols(gen, n, bits).tolist()
+        log = FrameLog(dut)
+        for v in values:
+            await uart.send_symbol(
+                dut, uart_timing.divider, v, bits,
+                bit_period_ps=uart_timing.ideal_bit_period_ps, ppm=ppm,
+                jitter=JITTER, glitches=glitches, rng=gen)
+        await ClockCycles(dut.clk, 2 * uart_timing.frame_cycles(bits))
+        log.stop()
+
+        failures[baud] = log.failures(values)
+        dut._log.info(f"{condition}: {baud} baud ({uart_timing.bit_cycles} "
+                      f"cycles per bit): {failures[baud]} failures in {n} "
+                      f"frames")
+
+    reliable = [baud for baud in ROBUSTNESS_BAUDS
+                if all(failures[b] == 0 for b in ROBUSTNESS_BAUDS if b <= baud)]
+    highest = max(reliable) if reliable else None
+    dut._log.info(f"{condition}: highest baud rate without failures: "
+                  f"{highest}")
+    if votes > 1 or not glitches:
+        assert highest is not None and highest >= RELIABLE_BAUD, \
+            f"No failures up to {RELIABLE_BAUD} baud"
+    else:
+        assert all(failures[baud] > 0 for baud in ROBUSTNESS_BAUDS
+                   if baud <= RELIABLE_BAUD), \
+            f"A single sample fails with glitches up to {RELIABLE_BAUD} " \
+            f"baud, the majority vote is needed"
+
+
+factory = TestFactory(robustness_sweep)
+factory.add_option("ppm", PPMS)
+factory.add_option("glitches", GLITCHES)
+factory.generate_tests()
+
+
+# Supported frame formats with the majority vote of three centre samples
+# (default) and a single centre sample
+PARAMETERS = runner.parameter_matrix(DATA_WIDTH=[5, 6, 7, 8, 9]) \
+    + [dict(VOTES=1)]
+
+
+@pytest.mark.parametrize("parameters", PARAMETERS, ids=runner.parameter_id)
+def test_runner(parameters, testcase):
     from pathlib import Path
-    from cocotb.runner import get_runner
 
     hdl_toplevel = "uart_rx"
-    sim = os.getenv("SIM", "verilator")
     project_path = Path(__file__).resolve().parent
 
-    verilog_sources = [project_path / f"{hdl_toplevel}.sv"]
-
-    build_args = ["--trace", "--trace-structs"] if sim == "verilator" else []
-    runner = get_runner(sim)
-    runner.build(
-        verilog_sources=verilog_sources,
-        vhdl_sources=[],
-        hdl_toplevel=hdl_toplevel,
-        always=True,
-        build_args=build_args,
-        build_dir=f"build/{hdl_toplevel}",
-    )
+    verilog_sources = [project_path / f"{hdl_toplevel}.sv",
+                       project_path / "uart_baud_fraction.sv"]
 
-    runner.test(hdl_toplevel=hdl_toplevel, test_module=f"{hdl_toplevel}_test,",
-                waves=True, extra_env={"WAVES": "1"})
+    runner.run(hdl_toplevel, verilog_sources, parameters=parameters,
+               testcase=testcase)
 
 
 if __name__ == "__main__":
-    test_runner()
+    for parameters in PARAMETERS:
+        test_runner(parameters, testcase=None)
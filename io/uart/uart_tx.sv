@@ -3,29 +3,35 @@
 // Author: David B. <initials_same_order_seperated_with_dot@nsch.at>
 // Description: Simple UART transceiver with runtime settings (except for data)
 //              Allows BAUD of 9600 at 50MHz and much faster settings.
-//              Single stop bit between transfers. Inputs are registered at
-//              next posedge of clk if not busy. Ongoing transfers can not be
-//              stopped.
-// Notes: Generic `DATA_WIDTH` is not yet implemented and must stay unaltered.
+//              `DATA_WIDTH` of 5 to 9 bits and one or two stop bits
+//              (`two_stop_bits`). Inputs are registered at next posedge of
+//              clk if `ready`, which is also the case during the last stop
+//              bit: A frame started then follows the current one without a
+//              gap and its configuration takes effect with its start bit.
+//              Ongoing transfers can not be stopped.
+//              A bit lasts `baud_divider + 1 + baud_fraction / 16` clock
+//              cycles on average, see `uart_baud_fraction`.
 module uart_tx (
     // System
-    input  logic        clk,
-    input  logic        rst,
+    input  logic                  clk,
+    input  logic                  rst,
     // Data
-    input  logic        start,
-    input  logic [ 7:0] data,
-    output logic        busy,
+    input  logic                  start,
+    input  logic [DATA_WIDTH-1:0] data,
+    output logic                  busy,
+    output logic                  ready,
     // Uart
-    output logic        tx,
+    output logic                  tx,
     // Configuration
-    input  logic [11:0] baud_divider,
-    input  logic        parity_en,
-    input  logic        parity_type_odd
+    input  logic [          11:0] baud_divider,
+    input  logic [           3:0] baud_fraction,
+    input  logic                  parity_en,
+    input  logic                  parity_type_odd,
+    input  logic                  two_stop_bits
 );
   // ╭───────────────────────────────────────────────────────────────────────╮
   // │                               Parameters                              │
   // ╰───────────────────────────────────────────────────────────────────────╯
-  // TODO: Not yet implemented
   parameter int DATA_WIDTH = 8;
 
   // ╭───────────────────────────────────────────────────────────────────────╮
@@ -46,38 +52,92 @@ module uart_tx (
   // Internal
   state_t state, next_state;
 
-  logic [ 3:0] bit_position;
-  logic [11:0] baud_counter;
-  logic        parity_bit;
+  logic [$clog2(DATA_WIDTH+1)-1:0] bit_position;
+  // One more than the divider for extended bits
+  logic                     [12:0] baud_counter;
+  logic                     [12:0] baud_limit;
+  logic                            baud_extend;
+  logic                            parity_bit;
+  // First of two stop bits, kept even if the next frame is accepted
+  logic                            extra_stop_bit;
+  logic                            last_stop_bit;
 
-  // Registered inputs
-  logic [ 7:0] data_registered;
-  logic [11:0] baud_divider_registered;
-  logic        parity_en_registered;
-  logic        parity_type_odd_registered;
-  logic        start_registered;
+  // Registered inputs, the configuration of the current frame
+  logic           [DATA_WIDTH-1:0] data_registered;
+  logic                     [11:0] baud_divider_registered;
+  logic                     [ 3:0] baud_fraction_registered;
+  logic                            parity_en_registered;
+  logic                            parity_type_odd_registered;
+  logic                            two_stop_bits_registered;
+  // Configuration of a frame accepted during the stop bit, which still uses
+  // the current one
+  logic                     [11:0] baud_divider_pending;
+  logic                     [ 3:0] baud_fraction_pending;
+  logic                            parity_en_pending;
+  logic                            parity_type_odd_pending;
+  logic                            two_stop_bits_pending;
+  // Frame accepted during the stop bit, starts after it
+  logic                            start_registered;
+  logic                            accept;
+  logic                            enter_start_bit;
 
   // ╭───────────────────────────────────────────────────────────────────────╮
   // │                                 Logic                                 │
   // ╰───────────────────────────────────────────────────────────────────────╯
+  // `data_registered` is not needed anymore during the stop bit
+  assign ready = (state == IDLE || last_stop_bit) && !start_registered;
+  assign accept = start && ready;
+  assign baud_limit = {1'b0, baud_divider_registered} + 13'(baud_extend);
+  assign last_stop_bit = (state == STOP_BIT) && !extra_stop_bit;
+  assign enter_start_bit = ((state == IDLE) || (baud_counter == baud_limit))
+                           && next_state == START_BIT;
+
+  always_ff @(posedge clk or posedge rst) begin
+    if (rst) begin
+      extra_stop_bit <= 0;
+    end else if (state != STOP_BIT) begin
+      extra_stop_bit <= two_stop_bits_registered;
+    end else if (baud_counter == baud_limit) begin
+      extra_stop_bit <= 0;
+    end
+  end
+
   always_ff @(posedge clk or posedge rst) begin
     if (rst) begin
       start_registered <= 0;
-    end else if (state == STOP_BIT && baud_counter == 0) begin
+    end else if (last_stop_bit && baud_counter == baud_limit) begin
       start_registered <= 0;
-    end else if (~busy && start) begin
+    end else if (last_stop_bit && accept) begin
       start_registered <= 1;
     end else begin
       start_registered <= start_registered;
     end
   end
 
+  // The configuration times the current stop bit and is only replaced when
+  // the next frame starts, directly from the inputs if accepted just then
   always_ff @(posedge clk) begin : register_inputs
-    if (!busy && start && !start_registered) begin
+    if (accept) begin
       data_registered <= data;
+      baud_divider_pending <= baud_divider;
+      baud_fraction_pending <= baud_fraction;
+      parity_en_pending <= parity_en;
+      parity_type_odd_pending <= parity_type_odd;
+      two_stop_bits_pending <= two_stop_bits;
+    end
+
+    if (enter_start_bit && accept) begin
       baud_divider_registered <= baud_divider;
+      baud_fraction_registered <= baud_fraction;
       parity_en_registered <= parity_en;
       parity_type_odd_registered <= parity_type_odd;
+      two_stop_bits_registered <= two_stop_bits;
+    end else if (enter_start_bit) begin
+      baud_divider_registered <= baud_divider_pending;
+      baud_fraction_registered <= baud_fraction_pending;
+      parity_en_registered <= parity_en_pending;
+      parity_type_odd_registered <= parity_type_odd_pending;
+      two_stop_bits_registered <= two_stop_bits_pending;
     end
   end
 
@@ -86,11 +146,11 @@ module uart_tx (
       state <= IDLE;
       busy  <= 0;
     end else begin
-      if ((state == IDLE) || (baud_counter == baud_divider_registered)) begin
+      if ((state == IDLE) || (baud_counter == baud_limit)) begin
         state <= next_state;
       end
 
-      if ((state === IDLE || state === STOP_BIT) && !start && !start_registered) begin
+      if ((state === IDLE || last_stop_bit) && !start && !start_registered) begin
         busy <= 0;
       end else begin
         busy <= 1;
@@ -102,13 +162,13 @@ module uart_tx (
     case (state)
       IDLE: begin
         // Cast needed for icarus
-        next_state = (start === 1 || start_registered === 1) ? START_BIT : IDLE;
+        next_state = (accept === 1) ? START_BIT : IDLE;
       end
       START_BIT: begin
         next_state = DATA_BITS;
       end
       DATA_BITS: begin
-        if (bit_position >= 4'(DATA_WIDTH - 1)) begin
+        if (bit_position >= $bits(bit_position)'(DATA_WIDTH - 1)) begin
           next_state = (parity_en_registered === 1) ? PARITY_BIT : STOP_BIT;
         end else begin
           next_state = DATA_BITS;
@@ -117,9 +177,13 @@ module uart_tx (
       PARITY_BIT: begin
         next_state = STOP_BIT;
       end
-      // Same as IDLE
+      // Continues with a frame accepted during the last stop bit
       STOP_BIT: begin
-        next_state = (start_registered === 1) ? START_BIT : IDLE;
+        if (extra_stop_bit) begin
+          next_state = STOP_BIT;
+        end else begin
+          next_state = (start_registered === 1 || accept === 1) ? START_BIT : IDLE;
+        end
       end
       default: begin
         next_state = IDLE;
@@ -134,10 +198,10 @@ module uart_tx (
       end
       DATA_BITS: begin
         // TODO: Which direction?
-        tx = data_registered[3'(bit_position)];
+        tx = data_registered[$clog2(DATA_WIDTH)'(bit_position)];
       end
       PARITY_BIT: begin
-        tx = (parity_type_odd) ? ~parity_bit : parity_bit;
+        tx = (parity_type_odd_registered) ? ~parity_bit : parity_bit;
       end
       default: begin
         tx = 1;
@@ -151,7 +215,7 @@ module uart_tx (
     end else if (state === IDLE) begin
       baud_counter <= 0;
     end else begin
-      if (baud_counter < baud_divider_registered) begin
+      if (baud_counter < baud_limit) begin
         baud_counter <= baud_counter + 1;
       end else begin
         baud_counter <= 0;
@@ -165,13 +229,31 @@ module uart_tx (
       parity_bit   <= 0;
     end else if (state != DATA_BITS) begin
       bit_position <= 0;
-      parity_bit   <= 0;
+      // Kept until the parity bit is sent
+      parity_bit   <= (state == PARITY_BIT) ? parity_bit : 1'b0;
     end else begin
-      if (baud_counter == baud_divider_registered) begin
-        parity_bit   <= parity_bit ^ data_registered[3'(bit_position)];
+      if (baud_counter == baud_limit) begin
+        parity_bit   <= parity_bit ^ data_registered[$clog2(DATA_WIDTH)'(bit_position)];
         bit_position <= bit_position + 1;
       end
     end
   end
+
+  // ╭───────────────────────────────────────────────────────────────────────╮
+  // │                                Modules                                │
+  // ╰───────────────────────────────────────────────────────────────────────╯
+  uart_baud_fraction #(
+      .FRACTION_WIDTH(4)
+  ) baud_fraction_mod (
+      // <<< System >>>
+      .clk(clk),
+      .rst(rst),
+      // <<< Bit timing >>>
+      .restart(state == IDLE),
+      .bit_end(baud_counter == baud_limit),
+      .extend(baud_extend),
+      // <<< Configuration >>>
+      .baud_fraction(baud_fraction_registered)
+  );
 endmodule
 
@@ -1,28 +1,41 @@
 import cocotb
-from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, FallingEdge, Timer
-
-
-async def reset_dut(dut):
-    await FallingEdge(dut.clk)
-    dut.rst.value = 1
-    await RisingEdge(dut.clk)
-    dut.rst.value = 0
-
-
-def configure(dut, baud: int, freq: float, parity: bool = False) -> None:
+import numpy as np
+import pytest
+from cocotb.regression import TestFactory
+from cocotb.triggers import RisingEdge, FallingEdge, ClockCycles, Edge
+from cocotb.utils import get_sim_time
+from helper import uart
+from tb import coverage, fixtures, runner, stimulus, watchdog
+from tb.timing import UartTiming
+
+# Deployed link configurations: Baud rates x (parity enable, odd parity)
+BAUDS = [115_200, 921_600, 3_125_000]
+PARITIES = [(False, False), (True, False), (True, True)]
+STOP_BITS = [1, 2]
+# Standard and high baud rates, most without an integer divider at 50 MHz
+FRACTIONAL_BAUDS = [115_200, 230_400, 921_600, 1_500_000, 3_000_000,
+                    4_000_000]
+
+
+def configure(dut, uart_timing: UartTiming, parity: bool = False,
+              parity_odd: bool = False, stop_bits: int = 1) -> None:
     """Sets default values for the module"""
     dut.rst.value = 0
-    dut.baud_divider.value = int(freq / baud)
+    dut.baud_divider.value = uart_timing.divider
+    dut.baud_fraction.value = uart_timing.fraction
     dut.parity_en.value = 1 if parity else 0
-    dut.parity_type_odd.value = 0
+    dut.parity_type_odd.value = 1 if parity_odd else 0
+    dut.two_stop_bits.value = 1 if stop_bits == 2 else 0
     dut.start.value = 0
 
 
 async def wait_until_not_busy(dut) -> None:
     """Returns immediatly if not busy and otherwise waits until it is"""
     if dut.busy.value == 1:
-        await FallingEdge(dut.busy)
+        await watchdog.wait(
+            dut, FallingEdge(dut.busy),
+            uart.frame_cycles(dut.baud_divider.value.integer),
+            "Frame should end")
 
 
 async def send_byte(dut, byte: int) -> None:
@@ -30,7 +43,8 @@ async def send_byte(dut, byte: int) -> None:
     Assumes a configured dut. Sends one byte and returns at next posedge
     If the dut is busy, it wait's until it's free again.
     """
-    assert byte <= 0xFF and byte >= 0, f"Provided byte is not valid: {byte}"
+    assert 0 <= byte < 2**dut.DATA_WIDTH.value, \
+        f"Provided byte is not valid: {byte}"
 
     await wait_until_not_busy(dut)
     dut.data.value = byte
@@ -39,115 +53,64 @@ async def send_byte(dut, byte: int) -> None:
     dut.start.value = 0
 
 
-async def receive_symbol(dut, baud: int, bits=8,
-                         parity=False, parity_odd=False):
-
-    # async def receive():
-    cycle = 1. / float(baud)
-    time_half_bit = Timer(int(cycle * 1e9 / 2.), 'ns')
-    time_bit = Timer(int(cycle * 1e9), 'ns')
-
-    value = 0
-
-    # Wait for start
-    await FallingEdge(dut.tx)
-
-    # Start bit
-    await time_half_bit
-    assert 0 == dut.tx.value, "Start bit is invalid"
-
-    # Data bits
-    parity_bit = 0
-    for i in range(bits):
-        await time_bit
-        data_bit = dut.tx.value & 1
-
-        value |= data_bit << i
-        parity_bit ^= data_bit
-
-    # Parity bit
-    if parity is True:
-        await time_bit
-        data_bit = dut.tx.value & 1
-
-        parity_bit = ~parity_bit if parity_odd else parity_bit
-        assert parity_bit == data_bit, "Parity does not match!"
-
-    # Stop bit
-    await time_bit
-    assert dut.tx.value == 1, "Stop bit is invalid"
-
-    # self.log.info("Read byte 0x%02x", b)
-    return value
-
-    # timer = Timer(period_ns + 10, 'ns')
-    # return cocotb.start(receive())
-    # result = await First(timer, task)
-
-
-# async def send_byte(dut, byte: int) -> None:
-#     dut.start.value = 1
-#     dut.data.value = byte
-#     assert dut.busy.value == 0, "Module is not ready"
-#     await RisingEdge(dut.clk)
-#     dut.start.value = 0
-#     dut.rst.value = 0
-
-
 @cocotb.test()
 async def simple_writes(dut):
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / 50e6)
-    baud = 115200
+    uart_timing = UartTiming()
     # uart_sink = UartSink(dut.tx, baud=baud, bits=8)
     # Below not in sync with `configure`
-    bits = 8
+    bits = dut.DATA_WIDTH.value
     parity = False
     parity_odd = True
 
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
 
-    configure(dut, baud, clk_freq)
-    await reset_dut(dut)
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
+    watchdog.budget(2 * 2**bits * uart_timing.frame_cycles(bits))
 
-    async def send_and_expect(dut, data_tx: int) -> None:
-        rx_task = cocotb.start_soon(
-            receive_symbol(dut, baud, bits, parity, parity_odd)
-        )
+    monitor = uart.UartMonitor(dut.clk, dut.tx, uart_timing.divider, bits,
+                               parity, parity_odd,
+                               clk_period_ps=uart_timing.clk_period_ps)
+    monitor.start()
 
+    async def send_and_expect(dut, data_tx: int) -> None:
         await send_byte(dut, data_tx)
 
-        data_rx = await rx_task
+        data_rx = await monitor.read()
 
         assert data_tx == data_rx, "Sent data does not match received data"
 
-    for v in range(256):
-        await send_byte(dut, v)
+    for v in range(2**bits):
+        await send_and_expect(dut, v)
+
+    monitor.stop()
+    assert 0 == monitor.errors, "No framing or parity errors"
 
     # For nicer traces:
-    await Timer(int(1./float(baud) * 4 * 1e9), 'ns')
+    await ClockCycles(dut.clk, 4 * uart_timing.bit_cycles)
 
 
 @cocotb.test()
 async def expect_wrong_baud_fails(dut):
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / 50e6)
-    baud = 115200
+    uart_timing = UartTiming()
     # uart_sink = UartSink(dut.tx, baud=baud, bits=8)
     # Below not in sync with `configure`
-    bits = 8
+    bits = dut.DATA_WIDTH.value
     parity = False
     parity_odd = True
 
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
 
-    configure(dut, baud, clk_freq)
-    await reset_dut(dut)
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
 
     data_tx = 0x05
     try:
+        half_baud = UartTiming(uart_timing.baud // 2, uart_timing.clk_hz)
         rx_task = cocotb.start_soon(
-            receive_symbol(dut, baud >> 1, bits, parity, parity_odd)
+            uart.receive_symbol(dut, half_baud.divider, bits, parity,
+                                parity_odd,
+                                clk_period_ps=uart_timing.clk_period_ps)
         )
 
         await send_byte(dut, data_tx)
@@ -164,31 +127,164 @@ async def expect_wrong_baud_fails(dut):
         assert False, "Wrong baud works"
 
 
-def test_runner():
-    import os
+async def configuration_matrix(dut, baud: int, parity: bool,
+                               parity_odd: bool, stop_bits: int):
+    """Corner and random symbols with one link configuration"""
+    uart_timing = UartTiming(baud)
+    bits = dut.DATA_WIDTH.value
+
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+    coverage.fsm(dut.clk, dut.state, uart.TX_STATES,
+                 uart.TX_TRANSITIONS)
+
+    configure(dut, uart_timing, parity, parity_odd, stop_bits)
+    await fixtures.reset(dut)
+
+    monitor = uart.UartMonitor(dut.clk, dut.tx, uart_timing.divider, bits,
+                               parity, parity_odd,
+                               clk_period_ps=uart_timing.clk_period_ps,
+                               stop_bits=stop_bits)
+    monitor.start()
+
+    values = stimulus.symbols(stimulus.rng(), 64, bits).tolist()
+    for v in values:
+        await send_byte(dut, v)
+        assert v == await monitor.read(), \
+            "Sent data does not match received data"
+
+    monitor.stop()
+    assert 0 == monitor.errors, "No framing or parity errors"
+
+
+factory = TestFactory(configuration_matrix)
+factory.add_option("baud", BAUDS)
+factory.add_option(("parity", "parity_odd"), PARITIES)
+factory.add_option("stop_bits", STOP_BITS)
+factory.generate_tests()
+
+
+async def bit_period_sweep(dut, baud: int):
+    """
+    Measures the average bit period of back-to-back frames of alternating bits
+    with the fractional divider, from the edges between bits of different
+    levels
+    """
+    uart_timing = UartTiming(baud, fractional=True)
+    integer_timing = UartTiming(baud, max_error=None)
+    bits = dut.DATA_WIDTH.value
+    frames = 16
+    value = int("01" * bits, 2) & (2**bits - 1)
+
+    # Bits that start with an edge, beginning with the first start bit
+    levels = stimulus.uart_frames([value] * frames, bits).ravel()
+    edge_bits = [0] + (np.flatnonzero(np.diff(levels)) + 1).tolist()
+
+    fixtures.start_clock(dut, uart_timing.clk_period_ps)
+    coverage.fsm(dut.clk, dut.state, uart.TX_STATES,
+                 uart.TX_TRANSITIONS)
+
+    configure(dut, uart_timing)
+    await fixtures.reset(dut)
+    watchdog.budget(2 * frames * uart_timing.frame_cycles(bits))
+
+    dut.data.value = value
+    dut.start.value = 1
+    await FallingEdge(dut.tx)
+    edges = [get_sim_time("ps")]
+    edge = Edge(dut.tx)
+    for _ in edge_bits[1:]:
+        await edge
+        edges.append(get_sim_time("ps"))
+    dut.start.value = 0
+
+    clk_period_ps = uart_timing.clk_period_ps
+    for start, end, n in zip(edges, edges[1:], np.diff(edge_bits).tolist()):
+        assert n * uart_timing.bit_cycles <= (end - start) // clk_period_ps \
+            <= n * (uart_timing.bit_cycles + 1), \
+            "Bits are extended by at most one cycle"
+
+    n = edge_bits[-1]
+    measured = edges[-1] - edges[0]
+    target = n * uart_timing.ideal_bit_period_ps
+    dut._log.info(f"{baud} baud: {float(measured / n):.0f} ps per bit, "
+                  f"target {float(target / n):.0f} ps, "
+                  f"error {float(measured / target - 1):+.3%} "
+                  f"(integer divider: {integer_timing.baud_error:+.3%})")
+    assert abs(measured - n * uart_timing.bit_period_ps) \
+        <= clk_period_ps, "Average bit period matches the fractional divider"
+    assert abs(measured - target) \
+        <= abs(n * integer_timing.bit_period_ps - target), \
+        "Fractional divider is at least as exact as the integer divider"
+
+
+factory = TestFactory(bit_period_sweep)
+factory.add_option("baud", FRACTIONAL_BAUDS)
+factory.generate_tests()
+
+
+@cocotb.test()
+async def back_to_back_divider_change(dut):
+    """
+    A frame accepted during the stop bit with a smaller divider must not
+    change the timing of that stop bit, but only of its own bits. Frames of
+    zeros start their stop bit with a rising edge
+    """
+    slow, fast = UartTiming(115_200), UartTiming(921_600)
+    bits = dut.DATA_WIDTH.value
+    clk_period_ps = slow.clk_period_ps
+
+    fixtures.start_clock(dut, clk_period_ps)
+
+    configure(dut, slow)
+    await fixtures.reset(dut)
+    watchdog.budget(3 * slow.frame_cycles(bits))
+
+    dut.data.value = 0
+    dut.start.value = 1
+    await RisingEdge(dut.clk)
+    dut.start.value = 0
+
+    # Past the divider of the next frame, which a shared counter would miss
+    await RisingEdge(dut.tx)
+    stop_bit = get_sim_time("ps")
+    await ClockCycles(dut.clk, fast.divider + 2)
+    assert dut.ready.value == 1, "Next frame is accepted during the stop bit"
+    dut.baud_divider.value = fast.divider
+    dut.start.value = 1
+    await RisingEdge(dut.clk)
+    dut.start.value = 0
+    dut.baud_divider.value = slow.divider
+
+    await FallingEdge(dut.tx)
+    start_bit = get_sim_time("ps")
+    await RisingEdge(dut.tx)
+    next_stop_bit = get_sim_time("ps")
+
+    assert slow.bit_cycles == (start_bit - stop_bit) // clk_period_ps, \
+        "Stop bit keeps the divider of its frame"
+    assert (bits + 1) * fast.bit_cycles \
+        == (next_stop_bit - start_bit) // clk_period_ps, \
+        "Next frame uses its own divider"
+
+
+# Supported frame formats
+PARAMETERS = runner.parameter_matrix(DATA_WIDTH=[5, 6, 7, 8, 9])
+
+
+@pytest.mark.parametrize("parameters", PARAMETERS, ids=runner.parameter_id)
+def test_runner(parameters, testcase):
     from pathlib import Path
-    from cocotb.runner import get_runner
 
     hdl_toplevel = "uart_tx"
-    sim = os.getenv("SIM", "verilator")
     project_path = Path(__file__).resolve().parent
 
-    verilog_sources = [project_path / "uart_tx.sv"]
-
-    build_args = ["--trace", "--trace-structs"] if sim == "verilator" else []
-    runner = get_runner(sim)
-    runner.build(
-        verilog_sources=verilog_sources,
-        vhdl_sources=[],
-        hdl_toplevel=hdl_toplevel,
-        always=True,
-        build_args=build_args,
-        build_dir=f"build/{hdl_toplevel}",
-    )
+    verilog_sources = [project_path / "uart_tx.sv",
+                       project_path / "uart_baud_fraction.sv"]
 
-    runner.test(hdl_toplevel=hdl_toplevel, test_module=f"{hdl_toplevel}_test,",
-                waves=True, extra_env={"WAVES": "1"})
+    runner.run(hdl_toplevel, verilog_sources, parameters=parameters,
+               testcase=testcase)
 
 
 if __name__ == "__main__":
-    test_runner()
+    for parameters in PARAMETERS:
+        test_runner(parameters, testcase=None)
@@ -4,12 +4,19 @@
 /// - Async read
 /// - Supports single cycle push and pop passthrough
 /// - Output values are valid within a clock cycle as long as `re` is asserted
+/// - Uses all `DEPTH` entries, `DEPTH` must be a power of two
+/// - `almost_full` while at least `ALMOST_FULL` entries are used, so a producer
+///   may write `DEPTH - ALMOST_FULL + 1` entries without checking `full`
+/// - `almost_empty` while at most `ALMOST_EMPTY` entries are used, so a
+///   consumer may read `ALMOST_EMPTY + 1` entries without checking `empty`
 /// ## Edge cases
 /// - Writes to a full fifo will be discarded
 /// - Reads from an empty fifo yield 0
 module fifo_simple #(
     parameter int DEPTH = 64,
-    parameter int DATA_WIDTH = 8
+    parameter int DATA_WIDTH = 8,
+    parameter int ALMOST_FULL = DEPTH - DEPTH / 4,
+    parameter int ALMOST_EMPTY = DEPTH / 4
 ) (
     // <<< System >>>
     input  logic                  clk,
@@ -23,7 +30,9 @@ module fifo_simple #(
     // <<< Status >>>
     output logic [     AdrBits:0] entries,
     output logic                  full,
-    output logic                  empty
+    output logic                  empty,
+    output logic                  almost_full,
+    output logic                  almost_empty
 );
 
   // ╭───────────────────────────────────────────────────────────────────────╮
@@ -34,6 +43,17 @@ module fifo_simple #(
   // logic [$clog2(DEPTH):0]  count;
   localparam int AdrBits = $clog2(DEPTH);
 
+  // Pointers wrap at `2**AdrBits` and thresholds compare against `size`
+  if (DEPTH < 2 || (DEPTH & (DEPTH - 1)) != 0) begin : check_depth
+    $error("DEPTH must be a power of two of at least 2, got %0d", DEPTH);
+  end
+  if (ALMOST_FULL <= 0 || ALMOST_FULL > DEPTH) begin : check_almost_full
+    $error("ALMOST_FULL must be in (0, DEPTH], got %0d", ALMOST_FULL);
+  end
+  if (ALMOST_EMPTY < 0 || ALMOST_EMPTY >= DEPTH) begin : check_almost_empty
+    $error("ALMOST_EMPTY must be in [0, DEPTH), got %0d", ALMOST_EMPTY);
+  end
+
   // ╭───────────────────────────────────────────────────────────────────────╮
   // │                                Signals                                │
   // ╰───────────────────────────────────────────────────────────────────────╯
@@ -42,16 +62,23 @@ module fifo_simple #(
   logic [AdrBits-1:0] wr_addr;
 
   logic               re_granted, we_granted;
+  logic [DATA_WIDTH-1:0] ram_dout;
 
   // ╭───────────────────────────────────────────────────────────────────────╮
   // │                              Assignments                              │
   // ╰───────────────────────────────────────────────────────────────────────╯
   assign empty = (size == 0);
-  assign full = (size == DEPTH[AdrBits:0] - 1);
+  assign full = (size == DEPTH[AdrBits:0]);
+  assign almost_full = (size >= ALMOST_FULL[AdrBits:0]);
+  assign almost_empty = (size <= ALMOST_EMPTY[AdrBits:0]);
   // Allowsp pop if true - Either contains some or passthrough mode
   assign re_granted = re && (!empty || we);
-  assign we_granted = we && !full;
+  // A simultaneous read frees a slot, which keeps `size` consistent
+  assign we_granted = we && (!full || re);
   assign entries = size;
+  // Passthrough bypasses the RAM. When full, the write replaces the entry
+  // that is read in the same cycle -> The RAM must not short circuit.
+  assign dout = (empty && re_granted) ? din : ram_dout;
 
   // ╭───────────────────────────────────────────────────────────────────────╮
   // │                                 Logic                                 │
@@ -68,8 +95,8 @@ module fifo_simple #(
         end
       end
       'b10: begin
-        if(size == DEPTH[AdrBits:0]-1) begin
-          size_next = DEPTH[AdrBits:0]-1;
+        if(size == DEPTH[AdrBits:0]) begin
+          size_next = DEPTH[AdrBits:0];
         end else begin
           size_next = size + 1;
         end
@@ -92,8 +119,6 @@ module fifo_simple #(
         rd_addr <= rd_addr + 1;
       end
 
-      // TODO: Test this functionality
-      // if (we && (!full || re)) begin
       if (we_granted) begin
         wr_addr <= wr_addr + 1;
       end
@@ -105,7 +130,8 @@ module fifo_simple #(
   // ╰───────────────────────────────────────────────────────────────────────╯
   ram_partial_dp_scd #(
       .DEPTH(DEPTH),
-      .DATA_WIDTH(DATA_WIDTH)
+      .DATA_WIDTH(DATA_WIDTH),
+      .SHORT_CIRCUIT(0)
   ) ram (
       .clk(clk),
       // Write Port
@@ -115,6 +141,6 @@ module fifo_simple #(
       // Read Port
       .re(re_granted),
       .r_addr(rd_addr),
-      .r_data(dout)
+      .r_data(ram_dout)
   );
 endmodule
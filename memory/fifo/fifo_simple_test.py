@@ -1,7 +1,11 @@
+import os
+from collections import deque
+
 import cocotb
-from cocotb.clock import Clock
+import pytest
 # from cocotb.regression import TestFactory
 from cocotb.triggers import RisingEdge, FallingEdge, Timer
+from tb import coverage, fixtures, runner, stimulus, watchdog
 
 # TODO:
 # - Read @ empty
@@ -9,7 +13,9 @@ from cocotb.triggers import RisingEdge, FallingEdge, Timer
 
 # module fifo_simple #(
 #   parameter int DEPTH = 64,
-#   parameter int DATA_WIDTH = 8
+#   parameter int DATA_WIDTH = 8,
+#   parameter int ALMOST_FULL = DEPTH - DEPTH / 4,
+#   parameter int ALMOST_EMPTY = DEPTH / 4
 # ) (
 #     input logic                   clk,
 #     input logic                   rst,
@@ -20,16 +26,30 @@ from cocotb.triggers import RisingEdge, FallingEdge, Timer
 #     input logic                   re,
 #     output logic [DATA_WIDTH-1:0] dout,
 #     // <<<< Status >>>>
+#     output logic [     AdrBits:0] entries,
 #     output logic                  full,
-#     output logic                  empty
+#     output logic                  empty,
+#     output logic                  almost_full,
+#     output logic                  almost_empty
 # );
 
 
-async def reset_dut(dut):
-    await FallingEdge(dut.clk)
-    dut.rst.value = 1
-    await RisingEdge(dut.clk)
-    dut.rst.value = 0
+# Operation of a cycle, crossed with the status before it
+OPERATIONS = ["idle", "write", "read", "write+read"]
+STATUS = ["empty", "partial", "full"]
+
+
+def cover(dut) -> None:
+    """Occupancy and operations per status, see `tb.coverage`"""
+    coverage.occupancy(dut.clk, dut.entries, dut.DEPTH.value)
+
+    we, re = coverage.reader(dut.we), coverage.reader(dut.re)
+    full, empty = coverage.reader(dut.full), coverage.reader(dut.empty)
+    coverage.sample(
+        dut.clk, "operations",
+        [f"{op}@{status}" for status in STATUS for op in OPERATIONS],
+        lambda: (2 if full() else 1 - empty()) * len(OPERATIONS)
+        + we() + 2 * re())
 
 
 def configure(dut) -> None:
@@ -71,13 +91,11 @@ async def write_read_value(dut, value: int) -> int:
 
 @cocotb.test()
 async def single_read_writes(dut):
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / clk_freq)
-
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut)
+    cover(dut)
 
     configure(dut)
-    await reset_dut(dut)
+    await fixtures.reset(dut)
 
     assert 1 == dut.empty.value, "Fifo after reset is empty"
     assert 0 == dut.full.value, "Fifo after reset is not full"
@@ -97,9 +115,10 @@ async def single_read_writes(dut):
     assert 0 == dut.full.value, ""
 
     # Fill FIFO up
-    for i in range(dut.DEPTH.value - 1):
+    mask = 2**dut.DATA_WIDTH.value - 1
+    for i in range(dut.DEPTH.value):
         assert 0 == dut.full.value, ""
-        await write_value(dut, i)
+        await write_value(dut, i & mask)
         assert 0 == dut.empty.value, ""
 
     assert 1 == dut.full.value, ""
@@ -108,13 +127,11 @@ async def single_read_writes(dut):
 @cocotb.test()
 async def simultanious_write_read_when_empty(dut):
     # TODO: Ceck when empty and not empty
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / clk_freq)
-
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut)
+    cover(dut)
 
     configure(dut)
-    await reset_dut(dut)
+    await fixtures.reset(dut)
     assert 1 == dut.empty.value, "Fifo after reset is empty"
     assert 0 == dut.dout.value, "Value when empty is zero"
 
@@ -129,13 +146,11 @@ async def simultanious_write_read_when_empty(dut):
 @cocotb.test()
 async def simultanious_write_read_not_empty(dut):
     # TODO: Ceck when empty and not empty
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / clk_freq)
-
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut)
+    cover(dut)
 
     configure(dut)
-    await reset_dut(dut)
+    await fixtures.reset(dut)
     assert 1 == dut.empty.value, "Fifo after reset is empty"
     assert 0 == dut.dout.value, "Value when empty is zero"
 
@@ -161,31 +176,28 @@ async def simultanious_write_read_not_empty(dut):
 
 @cocotb.test()
 async def overflow(dut):
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / clk_freq)
-
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut)
+    cover(dut)
 
     depth = dut.DEPTH.value
+    mask = 2**dut.DATA_WIDTH.value - 1
     for i in range(depth):
-        await write_value(dut, i)
+        await write_value(dut, i & mask)
         assert 0 == dut.empty.value, "Not empty after write w/o read"
 
     value = dut.dout.value
     for i in range(10):
         assert 1 == dut.full.value, "After full stays full"
         assert 0 == dut.empty.value, "When full it's not empty"
-        assert depth-1 == dut.entries.value, "Number of entries is stable"
+        assert depth == dut.entries.value, "Number of entries is stable"
         assert value == dut.dout.value, "Output value is stable"
         await write_value(dut, i % 3)
 
 
 @cocotb.test()
 async def underflow(dut):
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / clk_freq)
-
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut)
+    cover(dut)
 
     for _ in range(dut.DEPTH.value):
         await read_value(dut)
@@ -198,13 +210,130 @@ async def underflow(dut):
         await read_value(dut)
 
 
-def test_runner():
-    import os
+@cocotb.test()
+async def random_against_model(dut):
+    """
+    Compares all outputs with the precomputed expected trace every cycle.
+    See `CYCLES`
+    """
+    fixtures.start_clock(dut)
+    cover(dut)
+
+    configure(dut)
+    await fixtures.reset(dut)
+
+    depth = dut.DEPTH.value
+    data_width = dut.DATA_WIDTH.value
+    cycles = int(os.getenv("CYCLES", str(max(20_000, 16 * depth))))
+    watchdog.budget(2 * cycles)
+
+    inputs = stimulus.fifo_transactions(stimulus.rng(), depth, data_width,
+                                        cycles)
+    expected = stimulus.fifo_expected(inputs["we"], inputs["re"],
+                                      inputs["din"], depth,
+                                      dut.ALMOST_FULL.value,
+                                      dut.ALMOST_EMPTY.value)
+
+    we, re = inputs["we"], inputs["re"]
+    full, empty = expected["full"], expected["empty"]
+    corners = {
+        "full": full.sum(),
+        "empty": empty.sum(),
+        "write when full": (we & full).sum(),
+        "read when empty": (re & ~we & empty).sum(),
+        "passthrough": (we & re & empty).sum(),
+        "write and read when full": (we & re & full).sum(),
+    }
+    dut._log.info("Corner cases in %d cycles: %s", cycles,
+                  {name: int(hits) for name, hits in corners.items()})
+
+    # Plain lists are indexed much faster than arrays
+    stimuli = zip(inputs["we"].tolist(), inputs["re"].tolist(),
+                  inputs["din"].tolist())
+    outputs = zip(expected["entries"].tolist(), full.tolist(),
+                  empty.tolist(), expected["almost_full"].tolist(),
+                  expected["almost_empty"].tolist(), expected["dout"].tolist())
+    rising, falling = RisingEdge(dut.clk), FallingEdge(dut.clk)
+
+    for cycle, ((w, r, din), (entries, f, e, af, ae, dout)) in enumerate(
+            zip(stimuli, outputs)):
+        dut.we.value = w
+        dut.re.value = r
+        dut.din.value = din
+        await falling
+
+        msg = f"in cycle {cycle} (we={w:d}, re={r:d}, entries={entries})"
+        assert entries == dut.entries.value, f"Entries differ {msg}"
+        assert f == dut.full.value, f"Full differs {msg}"
+        assert e == dut.empty.value, f"Empty differs {msg}"
+        assert af == dut.almost_full.value, f"Almost full differs {msg}"
+        assert ae == dut.almost_empty.value, f"Almost empty differs {msg}"
+        assert dout == dut.dout.value, f"Dout differs {msg}"
+
+        await rising
+
+
+@cocotb.test()
+async def sustained_write_read(dut):
+    """
+    One write and one read every cycle at each occupancy level, from empty to
+    full: The occupancy is kept and each read returns the oldest entry
+    """
+    fixtures.start_clock(dut)
+    cover(dut)
+
+    configure(dut)
+    await fixtures.reset(dut)
+
+    CYCLES_PER_LEVEL: int = 4
+    depth = dut.DEPTH.value
+    almost_full, almost_empty = dut.ALMOST_FULL.value, dut.ALMOST_EMPTY.value
+    values = stimulus.random_data(stimulus.rng(),
+                                  (depth + 1) * (CYCLES_PER_LEVEL + 1),
+                                  dut.DATA_WIDTH.value).tolist()
+    model = deque()
+    rising, falling = RisingEdge(dut.clk), FallingEdge(dut.clk)
+
+    for level in range(depth + 1):
+        msg = f"with {level} entries"
+        for _ in range(CYCLES_PER_LEVEL):
+            model.append(values.pop())
+            dut.we.value = 1
+            dut.re.value = 1
+            dut.din.value = model[-1]
+            await falling
+
+            assert level == dut.entries.value, f"Entries differ {msg}"
+            assert (level == depth) == dut.full.value, f"Full differs {msg}"
+            assert (level == 0) == dut.empty.value, f"Empty differs {msg}"
+            assert (level >= almost_full) == dut.almost_full.value, \
+                f"Almost full differs {msg}"
+            assert (level <= almost_empty) == dut.almost_empty.value, \
+                f"Almost empty differs {msg}"
+            assert model.popleft() == dut.dout.value, f"Dout differs {msg}"
+            await rising
+
+        # Next level
+        if level < depth:
+            model.append(values.pop())
+            dut.re.value = 0
+            dut.din.value = model[-1]
+            await rising
+
+    configure(dut)
+
+
+# Configurations instantiated by production designs, with default and custom
+# thresholds
+PARAMETERS = runner.parameter_matrix(DEPTH=[8, 64, 4096], DATA_WIDTH=[8, 64]) \
+    + [dict(DEPTH=64, DATA_WIDTH=8, ALMOST_FULL=60, ALMOST_EMPTY=1)]
+
+
+@pytest.mark.parametrize("parameters", PARAMETERS, ids=runner.parameter_id)
+def test_runner(parameters, testcase):
     from pathlib import Path
-    from cocotb.runner import get_runner
 
     hdl_toplevel = "fifo_simple"
-    sim = os.getenv("SIM", "verilator")
     project_path = Path(__file__).resolve().parent
 
     verilog_sources = [
@@ -212,22 +341,12 @@ def test_runner():
         project_path / "../ram/ram_partial_dp_scd.sv"
     ]
 
-    build_args = ["--trace", "--trace-structs"] if sim == "verilator" else []
-    runner = get_runner(sim)
-    runner.build(
-        verilog_sources=verilog_sources,
-        vhdl_sources=[],
-        hdl_toplevel=hdl_toplevel,
-        always=True,
-        build_args=build_args,
-        build_dir=f"build/{hdl_toplevel}",
-    )
-
-    runner.test(hdl_toplevel=hdl_toplevel, test_module=f"{hdl_toplevel}_test,",
-                waves=True, extra_env={"WAVES": "1"})
+    runner.run(hdl_toplevel, verilog_sources, parameters=parameters,
+               testcase=testcase)
 
 
 if __name__ == "__main__":
-    test_runner()
+    for parameters in PARAMETERS:
+        test_runner(parameters, testcase=None)
 
 
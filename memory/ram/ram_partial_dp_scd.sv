@@ -1,7 +1,10 @@
 /// Syn write with async read
+/// A read of the address written in the same cycle returns the written value
+/// (short circuit), or with `SHORT_CIRCUIT = 0` the stored one
 module ram_partial_dp_scd #(
   parameter int DEPTH = 64,
-  parameter int DATA_WIDTH = 8
+  parameter int DATA_WIDTH = 8,
+  parameter bit SHORT_CIRCUIT = 1
 ) (
   // <<< System >>>
   input  logic                    clk,
@@ -25,7 +28,8 @@ module ram_partial_dp_scd #(
   logic [(DATA_WIDTH-1):0] ram[DEPTH];
 
   logic short_circuit;
-  assign short_circuit = re == 1 && we == 1 && w_addr == r_addr;
+  assign short_circuit = SHORT_CIRCUIT && re == 1 && we == 1
+                         && w_addr == r_addr;
 
   always_comb begin
     if(re) begin
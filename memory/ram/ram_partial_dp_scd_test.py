@@ -1,14 +1,17 @@
+import os
+
 import cocotb
-from cocotb.clock import Clock
+import numpy as np
+import pytest
 # from cocotb.regression import TestFactory
 from cocotb.triggers import RisingEdge, FallingEdge
+from tb import fixtures, runner, stimulus, watchdog
+from tb.ram import READ, WRITE, RamDriver, march_c, schedule
 
 
 async def configure(dut) -> None:
     """Sets default values for the module"""
-    clk_freq = 50e6
-    clk_cycle = int(1e9 / clk_freq)
-    cocotb.start_soon(Clock(dut.clk, clk_cycle, units="ns").start())
+    fixtures.start_clock(dut)
 
     dut.we.value = 0
     dut.re.value = 0
@@ -16,146 +19,187 @@ async def configure(dut) -> None:
     await RisingEdge(dut.clk)
 
 
-async def write_value(dut, addr: int, value: int) -> None:
-    assert dut.DEPTH.value > addr, "Test writes to invalid addr"
-    assert 2**dut.DATA_WIDTH.value > value, "Test writes invalid symbol"
-
-    dut.we.value = 1
-    dut.w_data.value = value
-    dut.w_addr.value = addr
-    await RisingEdge(dut.clk)
-    dut.we.value = 0
-
-
-async def read_value(dut, addr: int) -> int:
-    assert dut.DEPTH.value > addr, "Test writes to invalid addr"
-
-    dut.re.value = 1
-    dut.r_addr.value = addr
-    await RisingEdge(dut.clk)
-    value = dut.r_data.value
-    dut.re.value = 0
-    return value
-
-
-async def write_read_value(dut, write_addr: int, value: int,
-                           read_addr: int) -> int:
-    """Write and read in the same clock cycle"""
-    assert dut.DEPTH.value > read_addr, "Test writes to invalid addr"
-    assert dut.DEPTH.value > write_addr, "Test writes to invalid addr"
-    assert 2**dut.DATA_WIDTH.value > value, "Test writes invalid symbol"
-
-    # Write
-    dut.we.value = 1
-    dut.w_addr.value = write_addr
-    dut.w_data.value = value
-    # Read
-    dut.re.value = 1
-    dut.r_addr.value = read_addr
-
-    await RisingEdge(dut.clk)
-    value = dut.r_data.value
-
-    dut.we.value = 0
-    dut.re.value = 0
-
-    return value
-
-
 @cocotb.test()
 async def single_read_writes(dut):
     await configure(dut)
+    ram = RamDriver(dut)
 
     # Single, seperate write and read
-    for addr in range(dut.DEPTH.value):
-        value = (addr+1) % 255
-        await write_value(dut, addr, value)
+    values = ((np.arange(ram.depth) + 1) % 255).tolist()
+    await ram.run((WRITE, addr, value) for addr, value in enumerate(values))
 
-    for addr in range(dut.DEPTH.value):
-        read = await read_value(dut, addr)
-        assert addr+1 == read, "Written and read value do not match"
+    reads = await ram.run((READ, addr, 0) for addr in range(ram.depth))
+    assert values == reads, "Written and read value do not match"
 
 
 @cocotb.test()
 async def overwrite_value(dut):
     await configure(dut)
+    ram = RamDriver(dut)
 
     addr = 0x03
+    reads = await ram.run([(WRITE, addr, 0x55), (READ, addr, 0),
+                           (WRITE, addr, 0xCC), (READ, addr, 0)])
+    assert [0x55, 0xCC] == reads, "Written and read value do not match"
 
-    value = 0x55
-    await write_value(dut, addr, value)
-    read = await read_value(dut, addr)
-    assert value == read, "Written and read value do not match"
-
-    value = 0xCC
-    await write_value(dut, addr, value)
-    read = await read_value(dut, addr)
-    assert value == read, "Written and read value do not match"
 
 @cocotb.test()
 async def simultanious_write_read_passthrough(dut):
     await configure(dut)
+    ram = RamDriver(dut)
 
     # Test pass-through at same address
     value = 1
     addr = 2
-    read = await write_read_value(dut, addr, value, addr)
-    await RisingEdge(dut.clk)
-    assert value == read, \
+    reads = await ram.run([(WRITE, addr, value), (READ, addr, 0)])
+    assert [value] == reads, \
         "Write and read same address should yield written value"
 
+    # Read again to test if it's really in memory
     value = (addr+1) % 255
-    await write_value(dut, addr, value)
+    reads = await ram.run([(WRITE, addr, value), (READ, addr, 0)])
+    reads += await ram.run([(READ, addr, 0)])
+    assert [value, value] == reads, "Written and read value do not match"
 
-    # Read again to test if it's really in memory
-    read = await read_value(dut, addr)
-    assert value == read, "Written and read value do not match"
+
+@cocotb.test()
+async def simultanious_write_read_same_cycle(dut):
+    """Read of the address written in the same cycle, driven directly"""
+    await configure(dut)
+    ram = RamDriver(dut)
+
+    addr, stored, written = 0x02, 0x0F, 0xF0
+    await ram.run([(WRITE, addr, stored)])
+
+    dut.we.value = 1
+    dut.w_addr.value = addr
+    dut.w_data.value = written
+    dut.re.value = 1
+    dut.r_addr.value = addr
+    await FallingEdge(dut.clk)
+    expected = written if ram.short_circuit else stored
+    assert expected == dut.r_data.value, \
+        "Read of the written address should yield the " \
+        + ("written" if ram.short_circuit else "stored") + " value"
+    await RisingEdge(dut.clk)
+
+    dut.we.value = 0
+    await FallingEdge(dut.clk)
+    assert written == dut.r_data.value, "Written and read value do not match"
+    await RisingEdge(dut.clk)
+    dut.re.value = 0
 
 
 @cocotb.test()
 async def simultanious_write_read_different_addr(dut):
     await configure(dut)
+    ram = RamDriver(dut)
 
     value_a = 0xBB
     value_b = 0x55
     addr_a = 0x03
     addr_b = 0x05
 
-    await write_value(dut, addr_a, value_a)
-    read_a = await write_read_value(dut, addr_b, value_b, addr_a)
-    assert value_a == read_a, ""
+    # Read of a and write of b share a cycle
+    reads = await ram.run([(WRITE, addr_a, value_a), (READ, addr_a, 0),
+                           (WRITE, addr_b, value_b), (READ, addr_b, 0)])
+    assert [value_a, value_b] == reads, "Written and read value do not match"
+
+
+@cocotb.test()
+async def march(dut):
+    """March C- over the full memory with solid and checkerboard data"""
+    await configure(dut)
+    ram = RamDriver(dut)
+
+    checkerboard = int("01" * dut.DATA_WIDTH.value, 2) & ram.mask
+    for background in (0, checkerboard):
+        inverse = background ^ ram.mask
+        reads = await ram.run(march_c(ram.depth, background, inverse))
+        assert (5 * ram.depth) == len(reads), "All reads were issued"
+
+
+@cocotb.test()
+async def random_read_after_write(dut):
+    """
+    Random traffic on both ports, `r_data` is compared every cycle with the
+    precomputed read-after-write results. See `CYCLES`
+    """
+    await configure(dut)
+
+    depth = dut.DEPTH.value
+    cycles = int(os.getenv("CYCLES", str(max(20_000, 4 * depth))))
+    watchdog.budget(2 * cycles)
+
+    inputs = stimulus.ram_transactions(stimulus.rng(), depth,
+                                       dut.DATA_WIDTH.value, cycles)
+    expected = stimulus.ram_expected(
+        **inputs, short_circuit=bool(dut.SHORT_CIRCUIT.value))
+
+    # Plain lists are indexed much faster than arrays
+    stimuli = zip(*(inputs[port].tolist()
+                    for port in ("we", "w_addr", "w_data", "re", "r_addr")))
+    outputs = zip(expected["r_data"].tolist(), expected["known"].tolist())
+    rising, falling = RisingEdge(dut.clk), FallingEdge(dut.clk)
+
+    for cycle, ((we, w_addr, w_data, re, r_addr), (r_data, known)) in \
+            enumerate(zip(stimuli, outputs)):
+        dut.we.value = we
+        dut.w_addr.value = w_addr
+        dut.w_data.value = w_data
+        dut.re.value = re
+        dut.r_addr.value = r_addr
+        await falling
+
+        if known:
+            assert r_data == dut.r_data.value, \
+                f"Read of {r_addr:#x} differs in cycle {cycle}"
+        await rising
+
+    dut.we.value = 0
+    dut.re.value = 0
+
+
+def test_schedule():
+    """Packing of transactions into cycles, without a simulator"""
+    # A write and the following read of the same address share a cycle,
+    # reads without data are accepted
+    assert [((WRITE, 3, 0x55), (READ, 3, 0))] == \
+        list(schedule([(WRITE, 3, 0x55), (READ, 3)]))
 
-    read_b = await read_value(dut, addr_b)
-    assert value_b == read_b, "Written and read value do not match"
+    # A read must not see the following write to the same address
+    assert [(None, (READ, 3, 0)), ((WRITE, 3, 0x55), None)] == \
+        list(schedule([(READ, 3), (WRITE, 3, 0x55)]))
+    assert [((WRITE, 4, 0x55), (READ, 3, 0))] == \
+        list(schedule([(READ, 3), (WRITE, 4, 0x55)]))
 
+    # Without short circuit a read sees the stored value instead
+    assert [((WRITE, 3, 0x55), (READ, 3, 0))] == \
+        list(schedule([(READ, 3), (WRITE, 3, 0x55)], short_circuit=False))
+    assert [((WRITE, 3, 0x55), None), (None, (READ, 3, 0))] == \
+        list(schedule([(WRITE, 3, 0x55), (READ, 3)], short_circuit=False))
 
-def test_runner():
-    import os
+
+# Configurations instantiated by production designs
+PARAMETERS = runner.parameter_matrix(DEPTH=[8, 64, 4096], DATA_WIDTH=[8, 64],
+                                     SHORT_CIRCUIT=[0, 1])
+
+
+@pytest.mark.parametrize("parameters", PARAMETERS, ids=runner.parameter_id)
+def test_runner(parameters, testcase):
     from pathlib import Path
-    from cocotb.runner import get_runner
 
     hdl_toplevel = "ram_partial_dp_scd"
-    sim = os.getenv("SIM", "verilator")
     project_path = Path(__file__).resolve().parent
 
     verilog_sources = [
         project_path / f"{hdl_toplevel}.sv"
     ]
 
-    build_args = ["--trace", "--trace-structs"] if sim == "verilator" else []
-    runner = get_runner(sim)
-    runner.build(
-        verilog_sources=verilog_sources,
-        vhdl_sources=[],
-        hdl_toplevel=hdl_toplevel,
-        always=True,
-        build_args=build_args,
-        build_dir=f"build/{hdl_toplevel}",
-    )
-
-    runner.test(hdl_toplevel=hdl_toplevel, test_module=f"{hdl_toplevel}_test,",
-                waves=True, extra_env={"WAVES": "1"})
+    runner.run(hdl_toplevel, verilog_sources, parameters=parameters,
+               testcase=testcase)
 
 
 if __name__ == "__main__":
-    test_runner()
+    for parameters in PARAMETERS:
+        test_runner(parameters, testcase=None)
@@ -0,0 +1,198 @@
+"""
+Benchmark of simulator configurations on the same tests.
+
+    python -m tb.bench [pytest arguments, e.g. memory/fifo or -k uart]
+    python -m tb.bench --verilator [pytest arguments]
+
+The first form compares every locally installed backend (Verilator, Icarus).
+The second compares `VERILATOR_VARIANTS` of build options and defaults to the
+larger configurations (buffered UARTs, deep FIFOs).
+
+All configurations use identical settings otherwise: Fresh builds in a
+separate cache (`build/bench/<configuration>`), no tracing (`WAVES=0`) and the
+parameters of each test. Afterwards a table of build time, run time and
+simulated cycles per second per toplevel, parameter set and configuration is
+printed. The speedup is relative to the first configuration and the fastest
+one of each row is marked by `*`. `threads` is the thread count of the
+Verilator model after limiting it to the available CPUs. Variants that ask for
+more threads than available are skipped, as they would only repeat a smaller
+variant under a misleading label.
+
+Tests that pass with one configuration but fail with another hint at a
+backend or option that silently miscompiles the design. They are listed and
+make the benchmark fail.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tb import perf
+from tb.runner import BUILD_ROOT, VerilatorOptions, available_cpus
+
+# cocotb simulator name -> executable
+BACKENDS: Dict[str, str] = {
+    "verilator": "verilator",
+    "icarus": "iverilog",
+}
+
+# Label -> environment, see `runner.VerilatorOptions`
+VERILATOR_VARIANTS: Dict[str, Dict[str, str]] = {
+    "plain": {"OPTIMIZE": "0", "THREADS": "1"},
+    "optimized": {"OPTIMIZE": "1", "THREADS": "1"},
+    "threads=2": {"OPTIMIZE": "1", "THREADS": "2"},
+    "threads=4": {"OPTIMIZE": "1", "THREADS": "4"},
+}
+VERILATOR_TESTS = ["io/uart/uart_buffered_tx_test.py",
+                   "io/uart/uart_buffered_rx_test.py",
+                   "memory/fifo/fifo_simple_test.py", "-k", "4096 or buffered"]
+
+# Separate cache, so that every model is built from scratch
+BENCH_ROOT = BUILD_ROOT / "bench"
+
+# (toplevel, parameter id) -> configuration -> test -> run
+Results = Dict[Tuple[str, str], Dict[str, Dict[str, dict]]]
+
+
+def installed_backends() -> Dict[str, Dict[str, str]]:
+    return {sim: {"SIM": sim} for sim, executable in BACKENDS.items()
+            if shutil.which(executable)}
+
+
+def requested_threads(env: Dict[str, str]) -> Optional[int]:
+    """
+    Model threads of a configuration before limiting them to the available
+    CPUs, `None` for other simulators than Verilator
+    """
+    env = dict(os.environ, **env)
+    if env.get("SIM", "verilator") != "verilator":
+        return None
+    return int(env.get("THREADS", str(VerilatorOptions().threads)))
+
+
+def model_threads(env: Dict[str, str]) -> str:
+    """Effective model threads of a configuration for the report"""
+    threads = requested_threads(env)
+    if threads is None:
+        return "-"
+    return str(VerilatorOptions(threads=threads).model_threads)
+
+
+def run_configuration(label: str, env: Dict[str, str],
+                      pytest_args: Sequence[str]) -> int:
+    """Runs the tests with `env` and returns the exit code of pytest"""
+    env = dict(os.environ, BUILD_ROOT=str((BENCH_ROOT / label).resolve()),
+               WAVES="0", PERF="1", **env)
+    command = [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider",
+               *pytest_args]
+    print(f"INFO: Running {' '.join(command)} as {label}", flush=True)
+    return subprocess.run(command, env=env, check=False).returncode
+
+
+def collect(labels: Sequence[str]) -> Results:
+    """Latest run of each configuration per test"""
+    results: Results = defaultdict(lambda: defaultdict(dict))
+    for label in labels:
+        for path in (BENCH_ROOT / label).glob(f"*/{perf.FILE}"):
+            summary = json.loads(path.read_text(encoding="utf-8"))
+            for test, parameter_sets in summary.items():
+                for parameter_id, history in parameter_sets.items():
+                    key = (path.parent.name, parameter_id)
+                    results[key][label][test] = history[-1]
+    return results
+
+
+def mismatches(results: Results, labels: Sequence[str]) -> List[str]:
+    """Tests whose outcome depends on the configuration"""
+    found = []
+    for (toplevel, parameter_id), runs_of in sorted(results.items()):
+        for label in labels:
+            if label not in runs_of:
+                found.append(f"{toplevel}[{parameter_id}]: No results of "
+                             f"{label}, the build or simulation failed")
+
+        tests = set().union(*(runs.keys() for runs in runs_of.values()))
+        for test in sorted(tests):
+            outcomes = {label: runs[test]["passed"]
+                        for label, runs in runs_of.items() if test in runs}
+            if len(set(outcomes.values())) > 1:
+                found.append(f"{toplevel}.{test}[{parameter_id}]: "
+                             + ", ".join(f"{label} "
+                                         f"{'passed' if ok else 'failed'}"
+                                         for label, ok in outcomes.items()))
+    return found
+
+
+def report(results: Results, labels: Sequence[str],
+           threads: Dict[str, str]) -> None:
+    print(f"{'toplevel':<20} {'parameters':<25} {'configuration':<14} "
+          f"{'threads':>7} {'build s':>8} {'run s':>8} {'speedup':>8} "
+          f"{'cycles/s':>10} {'passed':>7}")
+    for (toplevel, parameter_id), runs_of in sorted(results.items()):
+        rows = []
+        for label in labels:
+            runs = runs_of.get(label)
+            if not runs:
+                continue
+            wall_s = sum(run["wall_s"] for run in runs.values())
+            cycles = sum(run["cycles"] for run in runs.values())
+            passed = sum(run["passed"] for run in runs.values())
+            build_s = max(run["build_s"] for run in runs.values())
+            rows.append((label, build_s, wall_s,
+                         cycles / wall_s if wall_s else 0.0,
+                         f"{passed}/{len(runs)}"))
+
+        reference_s = rows[0][2]
+        fastest = min(rows, key=lambda row: row[2])[0]
+        for label, build_s, wall_s, cycles_per_s, passed in rows:
+            mark = "*" if label == fastest and len(rows) > 1 else " "
+            speedup = reference_s / wall_s if wall_s else 0.0
+            print(f"{toplevel:<20} {parameter_id:<25} {label:<13}{mark} "
+                  f"{threads[label]:>7} {build_s:8.2f} {wall_s:8.2f} "
+                  f"{speedup:7.2f}x {cycles_per_s:10.0f} {passed:>7}")
+
+
+def main(args: Sequence[str]) -> int:
+    if args[:1] == ["--verilator"]:
+        configurations = dict(VERILATOR_VARIANTS)
+        pytest_args = list(args[1:]) or VERILATOR_TESTS
+    else:
+        configurations = installed_backends()
+        pytest_args = list(args)
+    if not configurations:
+        print(f"ERROR: None of {', '.join(BACKENDS.values())} is installed")
+        return 1
+
+    cpus = available_cpus()
+    for label, env in list(configurations.items()):
+        requested = requested_threads(env)
+        if requested is not None and requested > cpus:
+            print(f"WARNING: Skipping {label}, it needs {requested} threads "
+                  f"but only {cpus} CPUs are available")
+            del configurations[label]
+
+    labels = list(configurations)
+    threads = {label: model_threads(env)
+               for label, env in configurations.items()}
+    shutil.rmtree(BENCH_ROOT, ignore_errors=True)
+    for label, env in configurations.items():
+        if run_configuration(label, env, pytest_args) != 0:
+            print(f"WARNING: Tests failed as {label}")
+
+    results = collect(labels)
+    print()
+    report(results, labels, threads)
+
+    found = mismatches(results, labels)
+    if len(labels) > 1 and found:
+        print("\nERROR: Results differ between configurations:")
+        print("\n".join(f"- {mismatch}" for mismatch in found))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,241 @@
+"""
+Functional coverage of state machines and occupancy.
+
+Enabled with `FCOV=1` (`COVERAGE` is taken by cocotb's Python code coverage).
+Tests declare what to cover, e.g.
+
+    coverage.fsm(dut.clk, dut.state, STATES)
+    coverage.occupancy(dut.clk, dut.entries, capacity)
+
+Without `FCOV` these calls do nothing. Otherwise, a sampler reads the signals
+at every falling edge of the clock - after the inputs of the cycle are applied
+- and increments a bin counter of the covergroup. Counters are NumPy arrays,
+so a sample costs one index computation and increment, no Python objects.
+
+At the end of each simulation the counters are merged into
+`build/<toplevel>/coverage.json` (safe for parallel xdist workers) together
+with the number of newly hit bins. Once further runs stop hitting new bins, a
+random regression has saturated. `python -m tb.coverage` prints the report,
+`python -m tb.coverage --reset` starts over.
+"""
+import fcntl
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cocotb
+import numpy as np
+from cocotb.triggers import FallingEdge
+
+from tb import hooks
+
+FILE = "coverage.json"
+# Latest runs kept per toplevel
+HISTORY = 50
+
+# Name -> covergroup of this simulation
+_groups: Dict[str, "Covergroup"] = {}
+
+
+def enabled() -> bool:
+    """Functional coverage selected via `FCOV`, disabled by default"""
+    return os.getenv("FCOV", "0") == "1"
+
+
+class Covergroup:
+    """Hit counter per named bin"""
+
+    def __init__(self, name: str, bins: Sequence[str]):
+        self.name = name
+        self.bins = list(bins)
+        self.counts = np.zeros(len(self.bins), dtype=np.int64)
+
+    def hits(self) -> Dict[str, int]:
+        return dict(zip(self.bins, self.counts.tolist()))
+
+
+def _group(name: str, bins: Sequence[str]) -> Covergroup:
+    """Covergroup `name`, shared by all tests of this simulation"""
+    if not _groups:
+        _install()
+    group = _groups.get(name)
+    if group is None or group.bins != list(bins):
+        group = _groups[name] = Covergroup(name, bins)
+    return group
+
+
+def sample(clk, name: str, bins: Sequence[str],
+           bin_of: Callable[[], Optional[int]]) -> Optional[Covergroup]:
+    """
+    Increments the bin `bin_of()` of covergroup `name` at every falling edge
+    of `clk` until the end of the test. `None` skips the sample.
+    """
+    if not enabled():
+        return None
+
+    group = _group(name, bins)
+    counts = group.counts
+
+    async def sampler():
+        edge = FallingEdge(clk)
+        while True:
+            await edge
+            index = bin_of()
+            if index is not None:
+                counts[index] += 1
+
+    cocotb.start_soon(sampler())
+    return group
+
+
+def reader(signal) -> Callable[[], int]:
+    """Integer value of `signal`, without a `BinaryValue` per read"""
+    return signal._handle.get_signal_val_long
+
+
+def fsm(clk, state, states: Sequence[str],
+        transitions: Optional[Sequence[Tuple[str, str]]] = None,
+        name: Optional[str] = None) -> None:
+    """
+    Visited states and transitions between different states of `state`.
+    Without `transitions` all pairs of states are bins, otherwise only the
+    given ones (other transitions, e.g. by reset, are not counted).
+    """
+    name = name or state._name
+    n = len(states)
+    read = reader(state)
+
+    def state_() -> Optional[int]:
+        current = read()
+        return current if current < n else None
+
+    if sample(clk, f"{name}.states", states, state_) is None:
+        return
+
+    if transitions is None:
+        transitions = [(a, b) for a in states for b in states if a != b]
+    labels = [f"{a}->{b}" for a, b in transitions]
+    # (from, to) -> bin, `None` if not covered
+    number = {label: i for i, label in enumerate(labels)}
+    index = [[number.get(f"{a}->{b}") for b in states] for a in states]
+    previous = [read()]
+
+    def transition() -> Optional[int]:
+        current = read()
+        hit = index[previous[0]][current] \
+            if max(previous[0], current) < n else None
+        previous[0] = current
+        return hit
+
+    sample(clk, f"{name}.transitions", labels, transition)
+
+
+def occupancy_bins(capacity: int) -> List[range]:
+    """Empty, one and two entries, quarters of the capacity and full"""
+    edges = sorted(edge for edge in {0, 1, 2, capacity // 4, capacity // 2,
+                                     3 * capacity // 4, capacity, capacity + 1}
+                   if edge <= capacity + 1)
+    return [range(lower, upper) for lower, upper in zip(edges, edges[1:])]
+
+
+def occupancy(clk, entries, capacity: int,
+              name: Optional[str] = None) -> None:
+    """Fill level `entries` of a buffer with `capacity` entries"""
+    bins = occupancy_bins(capacity)
+    labels = ["empty" if b.start == 0 else
+              "full" if b.start == capacity else
+              str(b.start) if len(b) == 1 else f"{b.start}-{b.stop - 1}"
+              for b in bins]
+    lookup = [i for i, b in enumerate(bins) for _ in b]
+    read = reader(entries)
+    sample(clk, name or entries._name, labels, lambda: lookup[read()])
+
+
+def merge(path: Path, parameter_id: str, groups: List[Covergroup]) -> None:
+    """Adds the counters to `path`. Safe for parallel workers"""
+    with open(path.with_suffix(".lock"), "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        summary = json.loads(path.read_text(encoding="utf-8")) \
+            if path.exists() else {"groups": {}, "runs": []}
+        parameter_groups = summary["groups"].setdefault(parameter_id, {})
+        new_bins = 0
+        for group in groups:
+            counts = parameter_groups.setdefault(group.name, {})
+            for label, count in group.hits().items():
+                new_bins += count > 0 and counts.get(label, 0) == 0
+                counts[label] = counts.get(label, 0) + count
+        summary["runs"].append({
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "parameters": parameter_id,
+            "samples": sum(int(group.counts.sum()) for group in groups),
+            "new_bins": new_bins,
+        })
+        del summary["runs"][:-HISTORY]
+        path.write_text(json.dumps(summary, indent=2, sort_keys=True),
+                        encoding="utf-8")
+
+
+def _install() -> None:
+    """Merges all covergroups when the simulation ends"""
+    from cocotb.regression import RegressionManager
+
+    path = Path(os.getenv("FCOV_FILE", FILE))
+    parameter_id = os.getenv("FCOV_ID", "default")
+
+    def wrap_tear_down(tear_down):
+        def _tear_down(self):
+            if _groups:
+                merge(path, parameter_id, list(_groups.values()))
+                _groups.clear()
+            tear_down(self)
+        return _tear_down
+
+    hooks.wrap(RegressionManager, "_tear_down", ["self"], wrap_tear_down)
+
+
+def saturation(runs: List[dict]) -> int:
+    """Runs since the last one that hit a new bin"""
+    stale = 0
+    for run in reversed(runs):
+        if run["new_bins"]:
+            break
+        stale += 1
+    return stale
+
+
+def report(build_root: Path) -> str:
+    lines = []
+    for path in sorted(build_root.glob(f"*/{FILE}")):
+        summary = json.loads(path.read_text(encoding="utf-8"))
+        lines.append(f"{path.parent.name}: {len(summary['runs'])} runs, "
+                     f"no new bins in the last "
+                     f"{saturation(summary['runs'])}")
+        for parameter_id, groups in sorted(summary["groups"].items()):
+            lines.append(f"  [{parameter_id}]")
+            for name, counts in sorted(groups.items()):
+                missing = [label for label, count in counts.items()
+                           if not count]
+                hit = len(counts) - len(missing)
+                lines.append(f"    {name:<30} {hit:>4}/{len(counts):<4} "
+                             f"{hit / len(counts):5.0%}"
+                             + (f"  missing: {', '.join(missing)}"
+                                if missing else ""))
+    return "\n".join(lines)
+
+
+def main(args: Sequence[str]) -> None:
+    from tb.runner import BUILD_ROOT
+
+    if "--reset" in args:
+        for path in BUILD_ROOT.glob(f"*/{FILE}"):
+            path.unlink()
+        return
+    print(report(BUILD_ROOT) or "No coverage recorded, run with FCOV=1")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,105 @@
+"""
+Clock and reset shared by all testbenches.
+
+    fixtures.start_clock(dut)
+    configure(dut)
+    await fixtures.reset(dut)
+
+`start_clock` drives a free-running clock with the period of `tb.timing`. A
+signal has at most one driver: Starting a clock again replaces the previous
+one, and all clocks stop with the test.
+
+The clock toggles outside of the scheduler. cocotb's Python `Clock` resumes a
+coroutine on every edge, whose write is then deferred to a `ReadWrite` phase -
+the largest share of the Python time of long UART tests. Instead, the GPI
+clock of cocotb is used where available (2.0 and later). Otherwise, a timed
+simulator callback toggles the signal directly, so the only Python cost of an
+edge is this callback and the triggers that actually wait on it.
+"""
+import inspect
+from typing import Callable, Dict, Optional
+
+import cocotb
+from cocotb import simulator
+from cocotb.clock import Clock
+from cocotb.triggers import ClockCycles, FallingEdge, GPITrigger
+from cocotb.utils import get_sim_steps
+
+from tb.timing import clk_period_ps
+
+# Signal path -> stops the clock driving it
+_stoppers: Dict[str, Callable[[], None]] = {}
+
+
+class _Toggle(GPITrigger):
+    """
+    Never fires, but toggles `signal` every `half_period` steps while primed.
+    Un-priming, i.e. killing the waiting task, stops the clock.
+    """
+
+    def __init__(self, signal, half_period: int):
+        super().__init__()
+        self._handle = signal._handle
+        self._half_period = half_period
+        self._level = 1
+
+    def prime(self, callback):
+        if self.cbhdl is None:
+            self._handle.set_signal_val_int(0, self._level)
+            self._schedule()
+        GPITrigger.prime(self, callback)
+
+    def _schedule(self) -> None:
+        self.cbhdl = simulator.register_timed_callback(
+            self._half_period, self._edge)
+
+    def _edge(self) -> None:
+        self._level ^= 1
+        self._handle.set_signal_val_int(0, self._level)
+        self._schedule()
+
+
+async def _drive(signal, period_ps: int) -> None:
+    await _Toggle(signal, get_sim_steps(period_ps // 2, "ps"))
+
+
+def _has_gpi_clock() -> bool:
+    return "impl" in inspect.signature(Clock).parameters
+
+
+def start_clock(dut, period_ps: Optional[int] = None, signal=None) -> None:
+    """
+    Drives `signal` (default: `dut.clk`) with `period_ps` (default:
+    `CLK_HZ`), starting high. Replaces a clock started before on the same
+    signal.
+    """
+    signal = dut.clk if signal is None else signal
+    period_ps = clk_period_ps() if period_ps is None else period_ps
+
+    stop_clock(signal)
+    if _has_gpi_clock():
+        clock = Clock(signal, period_ps, "ps", impl="gpi")
+        clock.start()
+        _stoppers[signal._path] = clock.stop
+    else:
+        _stoppers[signal._path] = \
+            cocotb.start_soon(_drive(signal, period_ps)).kill
+
+
+def stop_clock(signal) -> None:
+    """Stops the clock driving `signal`, if any"""
+    stop = _stoppers.pop(signal._path, None)
+    if stop is not None:
+        stop()
+
+
+async def reset(dut, cycles: int = 1, signal=None) -> None:
+    """
+    Asserts `signal` (default: `dut.rst`) for `cycles` rising edges of
+    `dut.clk`, starting at a falling edge. Returns right after the last one.
+    """
+    signal = dut.rst if signal is None else signal
+    await FallingEdge(dut.clk)
+    signal.value = 1
+    await ClockCycles(dut.clk, cycles)
+    signal.value = 0
@@ -0,0 +1,56 @@
+"""
+Wrappers of private cocotb methods, shared by `tb.perf`, `tb.coverage` and
+`tb.watchdog`.
+
+cocotb 1.x offers no public hooks for the start and end of a test, the end of
+a simulation or the reactions of its scheduler, so these modules wrap private
+methods of `RegressionManager` and `Scheduler`. They only exist with the
+signatures below in the cocotb versions pinned in `requirements.txt`. Any
+other version or a changed signature raises a `RuntimeError` when the module
+is loaded, instead of silently recording nothing.
+"""
+import inspect
+from typing import Callable, Sequence
+
+import cocotb
+
+# `major.minor` of the cocotb releases these wrappers are written for
+SUPPORTED_VERSIONS = ("1.9",)
+
+
+def check_version() -> None:
+    version = ".".join(cocotb.__version__.split(".")[:2])
+    if version not in SUPPORTED_VERSIONS:
+        raise RuntimeError(
+            f"tb wraps private methods of cocotb "
+            f"{', '.join(SUPPORTED_VERSIONS)}, but cocotb "
+            f"{cocotb.__version__} is installed")
+
+
+def attribute(obj, name: str):
+    """Private attribute `name` of `obj`, fails loudly if it is missing"""
+    check_version()
+    try:
+        return getattr(obj, name)
+    except AttributeError:
+        raise RuntimeError(f"cocotb {cocotb.__version__} has no "
+                           f"{type(obj).__name__}.{name}") from None
+
+
+def wrap(cls, name: str, parameters: Sequence[str],
+         wrapper: Callable[[Callable], Callable]) -> None:
+    """
+    Replaces the method `cls.name` by `wrapper(original)`. `parameters` are
+    the expected parameter names of the original, including `self`.
+    """
+    check_version()
+    original = getattr(cls, name, None)
+    if original is None:
+        raise RuntimeError(f"cocotb {cocotb.__version__} has no "
+                           f"{cls.__name__}.{name}")
+    found = list(inspect.signature(original).parameters)
+    if found != list(parameters):
+        raise RuntimeError(f"{cls.__name__}.{name} of cocotb "
+                           f"{cocotb.__version__} takes {found} instead of "
+                           f"{list(parameters)}")
+    setattr(cls, name, wrapper(original))
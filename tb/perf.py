@@ -0,0 +1,178 @@
+"""
+Per-test performance instrumentation.
+
+`runner.run` loads this module into every simulation (disable with `PERF=0`).
+It hooks into cocotb's scheduler and regression manager (see `tb.hooks`) and
+records per test:
+- Wall time, split into time spent in Python coroutines and in the simulator
+- Simulated time and clock cycles of the `CLK_HZ` clock
+- Simulated cycles per wall second
+- Per trigger type: Wake-ups and the Python time spent reacting to them
+- Simulator and the time it took to build the model
+
+Results are merged into `build/<toplevel>/perf.json` as
+`{test: {parameters: [run, ...]}}`, keeping the last `HISTORY` runs to track
+regressions. `python -m tb.perf` lists the latest runs, slowest first.
+"""
+import fcntl
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+import cocotb
+
+from tb import hooks
+from tb.timing import clk_period_ps
+
+FILE = "perf.json"
+HISTORY = 20
+# Parameter id of runs without parameters
+DEFAULT_ID = "default"
+
+log = logging.getLogger("cocotb.perf")
+
+
+def enabled() -> bool:
+    """Instrumentation selected via `PERF`, enabled by default"""
+    return os.getenv("PERF", "1") == "1"
+
+
+class Recorder:
+    """Accumulates the Python time of the running test per trigger type"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.python_s = 0.0
+        # Trigger name -> [wake-ups, Python time]
+        self.triggers: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+
+    def react(self, trigger, elapsed_s: float) -> None:
+        stats = self.triggers[type(trigger).__name__]
+        stats[0] += 1
+        stats[1] += elapsed_s
+        self.python_s += elapsed_s
+
+    def result(self, test: str, passed: bool, wall_s: float,
+               sim_time_ns: float) -> dict:
+        from tb.runner import get_sim
+
+        cycles = round(sim_time_ns * 1000 / clk_period_ps())
+        return {
+            "test": test,
+            "passed": passed,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sim": get_sim(),
+            "waves": os.getenv("WAVES", "1") == "1",
+            "build_s": float(os.getenv("PERF_BUILD_S", "0")),
+            "wall_s": wall_s,
+            "python_s": self.python_s,
+            "simulator_s": max(wall_s - self.python_s, 0.0),
+            "sim_time_ns": sim_time_ns,
+            "cycles": cycles,
+            "cycles_per_s": cycles / wall_s if wall_s else 0.0,
+            "triggers": {
+                name: {"count": count, "python_s": python_s}
+                for name, (count, python_s) in sorted(self.triggers.items())
+            },
+        }
+
+
+def merge(path: Path, parameter_id: str, runs: List[dict]) -> None:
+    """Appends `runs` to the history in `path`. Safe for parallel workers"""
+    with open(path.with_suffix(".lock"), "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        summary = json.loads(path.read_text(encoding="utf-8")) \
+            if path.exists() else {}
+        for run in runs:
+            history = summary.setdefault(run["test"], {}) \
+                .setdefault(parameter_id, [])
+            history.append(run)
+            del history[:-HISTORY]
+        path.write_text(json.dumps(summary, indent=2, sort_keys=True),
+                        encoding="utf-8")
+
+
+def install(path: Path, parameter_id: str) -> None:
+    """Hooks into the scheduler and regression manager of this simulation"""
+    from cocotb.regression import RegressionManager
+    from cocotb.scheduler import Scheduler
+
+    recorder = Recorder()
+
+    def wrap_react(react):
+        def _react(self, trigger):
+            # Triggers fired while reacting are handled by the outer call
+            if self._is_reacting:
+                return react(self, trigger)
+            start = time.perf_counter()
+            try:
+                return react(self, trigger)
+            finally:
+                recorder.react(trigger, time.perf_counter() - start)
+        return _react
+
+    def wrap_start_test(start_test):
+        def _start_test(self):
+            recorder.reset()
+            start_test(self)
+        return _start_test
+
+    def wrap_record_result(record_result):
+        def _record_result(self, test, outcome, wall_time_s, sim_time_ns):
+            record_result(self, test, outcome, wall_time_s, sim_time_ns)
+            if outcome is None:
+                return  # Skipped
+
+            run = recorder.result(test.__qualname__,
+                                  bool(self.test_results[-1]["pass"]),
+                                  wall_time_s, sim_time_ns)
+            log.info("%s: %.2f s wall (%.0f%% Python), %d cycles, "
+                     "%.0f cycles/s", run["test"], run["wall_s"],
+                     100 * run["python_s"] / (run["wall_s"] or 1),
+                     run["cycles"], run["cycles_per_s"])
+            merge(path, parameter_id, [run])
+        return _record_result
+
+    hooks.wrap(Scheduler, "_react", ["self", "trigger"], wrap_react)
+    hooks.wrap(RegressionManager, "_start_test", ["self"], wrap_start_test)
+    hooks.wrap(RegressionManager, "_record_result",
+               ["self", "test", "outcome", "wall_time_s", "sim_time_ns"],
+               wrap_record_result)
+
+
+def latest(build_root: Path) -> List[dict]:
+    """Latest run of every test and parameter set, slowest first"""
+    runs = []
+    for path in build_root.glob(f"*/{FILE}"):
+        summary = json.loads(path.read_text(encoding="utf-8"))
+        for parameter_sets in summary.values():
+            for parameter_id, history in parameter_sets.items():
+                runs.append(dict(history[-1], toplevel=path.parent.name,
+                                 parameters=parameter_id))
+    return sorted(runs, key=lambda run: run["wall_s"], reverse=True)
+
+
+def main() -> None:
+    from tb.runner import BUILD_ROOT
+
+    print(f"{'wall s':>8} {'python':>7} {'cycles/s':>10}  test")
+    for run in latest(BUILD_ROOT):
+        python = run["python_s"] / (run["wall_s"] or 1)
+        print(f"{run['wall_s']:8.2f} {python:7.0%} {run['cycles_per_s']:10.0f}"
+              f"  {run['toplevel']}.{run['test']}[{run['parameters']}]")
+
+
+# Imported by cocotb as part of `MODULE` -> Instrument this simulation
+if cocotb.SIM_NAME is not None and "PERF_FILE" in os.environ:
+    install(Path(os.environ["PERF_FILE"]),
+            os.getenv("PERF_ID", DEFAULT_ID))
+
+if __name__ == "__main__":
+    main()
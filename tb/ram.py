@@ -0,0 +1,149 @@
+"""
+Batch driver for `ram_partial_dp_scd` with a shadow memory.
+
+    ram = RamDriver(dut)
+    reads = await ram.run([(WRITE, 3, 0x55), (READ, 3)])
+
+Transactions are `(op, addr, data)` tuples, issued in order. Reads may omit
+`data`. Consecutive transactions share a clock cycle whenever they use
+different ports and the order is kept, so both ports are busy every cycle of a
+mixed batch. Every read is checked against a shadow memory, including the
+short circuit of a write and read of the same address in one cycle (or the
+stored value with `SHORT_CIRCUIT = 0`).
+"""
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from cocotb.triggers import FallingEdge, RisingEdge
+
+READ = "r"
+WRITE = "w"
+
+
+class Transaction(NamedTuple):
+    op: str
+    addr: int
+    # Ignored by reads
+    data: int = 0
+
+
+# `(op, addr)` or `(op, addr, data)`, see `Transaction`
+TransactionLike = Tuple[Any, ...]
+# Write and read of one clock cycle, either may be idle
+Cycle = Tuple[Optional[Transaction], Optional[Transaction]]
+
+
+def schedule(transactions: Iterable[TransactionLike],
+             short_circuit: bool = True) -> Iterator[Cycle]:
+    """
+    Packs transactions into clock cycles. With `short_circuit` a read of the
+    address written in the same cycle sees the written value, otherwise the
+    stored one. A write may thus share its cycle with the following read and
+    a read with the following write, unless the order of a write and read of
+    the same address would change.
+    """
+    pending: Optional[Transaction] = None
+    for transaction in (Transaction(*t) for t in transactions):
+        if pending is None:
+            pending = transaction
+        elif (pending.op == WRITE and transaction.op == READ
+              and (short_circuit or pending.addr != transaction.addr)):
+            yield pending, transaction
+            pending = None
+        elif (pending.op == READ and transaction.op == WRITE
+              and (not short_circuit or pending.addr != transaction.addr)):
+            yield transaction, pending
+            pending = None
+        else:
+            yield (pending, None) if pending.op == WRITE else (None, pending)
+            pending = transaction
+    if pending is not None:
+        yield (pending, None) if pending.op == WRITE else (None, pending)
+
+
+def march_c(depth: int, background: int, inverse: int) -> List[Transaction]:
+    """
+    March C- over all addresses:
+    up(w0); up(r0, w1); up(r1, w0); down(r0, w1); down(r1, w0); up(r0)
+    """
+    up, down = range(depth), range(depth - 1, -1, -1)
+    transactions = [Transaction(WRITE, addr, background) for addr in up]
+    for order, written in ((up, inverse), (up, background),
+                           (down, inverse), (down, background)):
+        for addr in order:
+            transactions.append(Transaction(READ, addr))
+            transactions.append(Transaction(WRITE, addr, written))
+    transactions.extend(Transaction(READ, addr) for addr in up)
+    return transactions
+
+
+class RamDriver:
+    """
+    Drives both ports of `ram_partial_dp_scd`. Handles and parameters are
+    looked up once. Batches must start right after a rising edge of `dut.clk`
+    and end right after one. Inputs change after the rising edge, reads are
+    sampled at the falling edge.
+    """
+
+    def __init__(self, dut):
+        self.depth = dut.DEPTH.value
+        self.mask = 2**dut.DATA_WIDTH.value - 1
+        self.short_circuit = bool(dut.SHORT_CIRCUIT.value)
+        # Contents as written so far, `None` is unknown
+        self.shadow: List[Optional[int]] = [None] * self.depth
+
+        self.we, self.w_addr, self.w_data = dut.we, dut.w_addr, dut.w_data
+        self.re, self.r_addr, self.r_data = dut.re, dut.r_addr, dut.r_data
+        self.rising, self.falling = RisingEdge(dut.clk), FallingEdge(dut.clk)
+
+    def _check(self, transaction: Transaction) -> None:
+        assert transaction.op in (READ, WRITE), \
+            f"Invalid operation {transaction.op!r}"
+        assert 0 <= transaction.addr < self.depth, \
+            f"Transaction to invalid address {transaction.addr:#x}"
+        assert 0 <= transaction.data <= self.mask, \
+            f"Transaction with invalid symbol {transaction.data:#x}"
+
+    async def run(self, transactions: Iterable[TransactionLike]
+                  ) -> List[Optional[int]]:
+        """
+        Issues all transactions and returns the read values in order, `None`
+        if undefined
+        """
+        reads = []
+        for write, read in schedule(transactions, self.short_circuit):
+            if write is not None:
+                self._check(write)
+                self.we.value = 1
+                self.w_addr.value = write.addr
+                self.w_data.value = write.data
+            else:
+                self.we.value = 0
+
+            if read is not None:
+                self._check(read)
+                self.re.value = 1
+                self.r_addr.value = read.addr
+                await self.falling
+
+                value = self.r_data.value
+                value = value.integer if value.is_resolvable else None
+                if (self.short_circuit and write is not None
+                        and write.addr == read.addr):
+                    expected = write.data
+                else:
+                    expected = self.shadow[read.addr]
+                if expected is not None:
+                    assert expected == value, \
+                        f"Read of {read.addr:#x} returned {value} " \
+                        f"instead of {expected:#x}"
+                reads.append(value)
+            else:
+                self.re.value = 0
+
+            if write is not None:
+                self.shadow[write.addr] = write.data
+            await self.rising
+
+        self.we.value = 0
+        self.re.value = 0
+        return reads
@@ -0,0 +1,328 @@
+"""
+Shared build and test layer used by every `test_runner()`.
+
+Models are content-addressed: the build directory is derived from a hash over
+the simulator, toplevel, source contents, parameters and build arguments. A
+model is only (re-)built if no finished build with the same hash exists, so
+repeated pytest invocations skip verilation and C++ compilation entirely.
+Set `REBUILD=1` to force a fresh build and `BUILD_ROOT` to use another cache.
+
+Tracing is selected with `WAVES` (or `pytest --waves`):
+- `1`: Always record waveforms (default)
+- `0`: Never record waveforms
+- `fail`: Run untraced models and only re-run failing tests with tracing,
+  using the same `RANDOM_SEED` to reproduce the failure
+
+Verilator models are configured with `VerilatorOptions` (threads, build jobs,
+optimization, trace format), see there for the environment overrides.
+
+Per-test timings are recorded by `tb.perf` unless `PERF=0`, functional
+coverage by `tb.coverage` with `FCOV=1`. Every test runs within the
+simulated-time budget of `tb.watchdog`.
+"""
+import fcntl
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence
+
+import cocotb
+from cocotb.runner import get_runner
+
+from tb import coverage, perf
+
+BUILD_ROOT = Path(os.getenv("BUILD_ROOT", "build"))
+MANIFEST = "build.json"
+WAVES_MODES = ("1", "0", "fail")
+TRACE_FORMATS = ("vcd", "fst")
+
+log = logging.getLogger(__name__)
+
+
+def get_sim() -> str:
+    """Simulator selected via `SIM`, defaults to verilator"""
+    return os.getenv("SIM", "verilator")
+
+
+def get_waves() -> str:
+    """Waveform mode selected via `WAVES`, see module documentation"""
+    mode = os.getenv("WAVES", "1")
+    if mode not in WAVES_MODES:
+        raise ValueError(f"WAVES must be one of {WAVES_MODES}, got: {mode}")
+    return mode
+
+
+def available_cpus() -> int:
+    return len(os.sched_getaffinity(0))
+
+
+class VerilatorOptions(NamedTuple):
+    """
+    Build options of Verilator models. Test runners pass their per-module
+    defaults, the environment variables in brackets override them for all
+    modules. `jobs` only affects the build speed and not the model.
+    """
+    # [THREADS] Threads of the simulation model (`--threads`)
+    threads: int = 1
+    # [JOBS] Parallel verilation and C++ compilation, 0 = all CPUs
+    jobs: int = 0
+    # [OPTIMIZE] 1 for `-O3 --x-assign fast`, which hides X propagation bugs
+    optimize: bool = False
+    # [TRACE_FORMAT] Waveform format: `vcd` or `fst` (smaller, slower)
+    trace_format: str = "vcd"
+
+    def from_env(self) -> "VerilatorOptions":
+        options = self._replace(
+            threads=int(os.getenv("THREADS", str(self.threads))),
+            jobs=int(os.getenv("JOBS", str(self.jobs))),
+            optimize=os.getenv("OPTIMIZE", str(int(self.optimize))) == "1",
+            trace_format=os.getenv("TRACE_FORMAT", self.trace_format),
+        )
+        if options.trace_format not in TRACE_FORMATS:
+            raise ValueError(f"TRACE_FORMAT must be one of {TRACE_FORMATS}, "
+                             f"got: {options.trace_format}")
+        return options
+
+    @property
+    def parallel_jobs(self) -> int:
+        return self.jobs or available_cpus()
+
+    @property
+    def model_threads(self) -> int:
+        """
+        The Verilator runtime uses at most one thread per available CPU and
+        rejects models with more threads
+        """
+        return max(1, min(self.threads, available_cpus()))
+
+    def build_args(self, waves: bool) -> List[str]:
+        """Arguments that affect the model and are thus part of its hash"""
+        args = []
+        if self.model_threads > 1:
+            args += ["--threads", str(self.model_threads)]
+        if self.optimize:
+            args += ["-O3", "--x-assign", "fast"]
+        if waves:
+            args += ["--trace-structs"]
+            if self.trace_format == "fst":
+                args += ["--trace-fst"]
+        return args
+
+
+def parameter_matrix(**axes: Sequence[object]) -> List[Dict[str, object]]:
+    """All combinations of the parameter values, e.g. `DEPTH=[64, 4096]`"""
+    names = list(axes)
+    return [dict(zip(names, values))
+            for values in itertools.product(*axes.values())]
+
+
+def parameter_id(parameters: Mapping[str, object]) -> str:
+    """Readable pytest id of a parameter set"""
+    return "-".join(f"{name}={value}" for name, value in parameters.items())
+
+
+def build_manifest(sim: str, hdl_toplevel: str,
+                   verilog_sources: Sequence[Path],
+                   parameters: Mapping[str, object],
+                   build_args: Sequence[str], waves: bool) -> dict:
+    """Collects everything that influences the compiled model"""
+    return {
+        "sim": sim,
+        "cocotb": cocotb.__version__,
+        "hdl_toplevel": hdl_toplevel,
+        "sources": {
+            str(Path(source).resolve()):
+                hashlib.sha256(Path(source).read_bytes()).hexdigest()
+            for source in verilog_sources
+        },
+        "parameters": {k: str(v) for k, v in sorted(parameters.items())},
+        "build_args": list(build_args),
+        "waves": waves,
+    }
+
+
+def build_hash(manifest: dict) -> str:
+    encoded = json.dumps(manifest, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+@contextmanager
+def _environ(variables: Mapping[str, str]):
+    """Temporarily sets environment variables, which the runner copies"""
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def build(hdl_toplevel: str, verilog_sources: Sequence[Path],
+          parameters: Optional[Mapping[str, object]] = None,
+          build_args: Sequence[str] = (),
+          sim: Optional[str] = None, waves: bool = True,
+          verilator: Optional[VerilatorOptions] = None) -> Path:
+    """
+    Builds the model unless an identical one already exists.
+    Returns the build directory. Safe to call from parallel xdist workers.
+    """
+    sim = sim or get_sim()
+    parameters = dict(parameters or {})
+    build_args = list(build_args)
+    # Only affect the build speed and not the model -> Not part of the hash
+    speed_args: List[str] = []
+    build_env: Dict[str, str] = {}
+    if sim == "verilator":
+        verilator = (verilator or VerilatorOptions()).from_env()
+        build_args += verilator.build_args(waves)
+        speed_args += ["-j", str(verilator.parallel_jobs)]
+        build_env["MAKEFLAGS"] = f"-j{verilator.parallel_jobs}"
+
+    manifest = build_manifest(sim, hdl_toplevel, verilog_sources,
+                              parameters, build_args, waves)
+    digest = build_hash(manifest)[:16]
+    build_dir = (BUILD_ROOT / hdl_toplevel / digest).resolve()
+    build_dir.mkdir(parents=True, exist_ok=True)
+
+    # Concurrent workers wait for the first one to finish the build
+    with open(build_dir / ".lock", "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        stamp = build_dir / MANIFEST
+        if stamp.exists() and os.getenv("REBUILD", "0") != "1":
+            return build_dir
+        stamp.unlink(missing_ok=True)
+
+        start = time.perf_counter()
+        runner = get_runner(sim)
+        with _environ(build_env):
+            runner.build(
+                verilog_sources=verilog_sources,
+                vhdl_sources=[],
+                hdl_toplevel=hdl_toplevel,
+                parameters=parameters,
+                always=True,
+                build_args=build_args + speed_args,
+                build_dir=build_dir,
+                waves=waves,
+            )
+        # Only written after a successful build and thus marks it as usable
+        manifest["build_s"] = time.perf_counter() - start
+        stamp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    return build_dir
+
+
+def build_time(build_dir: Path) -> float:
+    """Time it took to build the (possibly cached) model in `build_dir`"""
+    stamp = json.loads((build_dir / MANIFEST).read_text(encoding="utf-8"))
+    return stamp.get("build_s", 0.0)
+
+
+def failed_tests(results_xml: Path) -> List[str]:
+    """Names of all failed testcases in a cocotb results file"""
+    return [
+        testcase.get("name")
+        for testcase in ET.parse(results_xml).iter("testcase")
+        if testcase.find("failure") is not None
+    ]
+
+
+def random_seed(results_xml: Path) -> Optional[str]:
+    """`RANDOM_SEED` of the run that wrote a cocotb results file"""
+    for prop in ET.parse(results_xml).iter("property"):
+        if prop.get("name") == "random_seed":
+            return prop.get("value")
+    return None
+
+
+def _test(runner, hdl_toplevel: str, verilog_sources: Sequence[Path],
+          test_module: str, parameters: Optional[Mapping[str, object]],
+          build_args: Sequence[str],
+          verilator: Optional[VerilatorOptions], testcase: Optional[str],
+          waves: bool, seed: Optional[str] = None) -> Path:
+    build_dir = build(hdl_toplevel, verilog_sources, parameters, build_args,
+                      get_sim(), waves, verilator)
+
+    extra_env = {"WAVES": "1" if waves else "0"}
+    # Budgets of all tests, see `tb.watchdog`
+    test_module = f"tb.watchdog,{test_module}"
+    if perf.enabled():
+        # Loaded as first module, to instrument all tests
+        test_module = f"tb.perf,{test_module}"
+        perf_file = (BUILD_ROOT / hdl_toplevel / perf.FILE).resolve()
+        extra_env["PERF_FILE"] = str(perf_file)
+        extra_env["PERF_ID"] = parameter_id(parameters) if parameters \
+            else perf.DEFAULT_ID
+        extra_env["PERF_BUILD_S"] = str(build_time(build_dir))
+    if coverage.enabled():
+        coverage_file = (BUILD_ROOT / hdl_toplevel / coverage.FILE).resolve()
+        extra_env["FCOV_FILE"] = str(coverage_file)
+        extra_env["FCOV_ID"] = parameter_id(parameters) if parameters \
+            else perf.DEFAULT_ID
+
+    return runner.test(
+        hdl_toplevel=hdl_toplevel,
+        hdl_toplevel_lang="verilog",
+        test_module=test_module,
+        testcase=testcase,
+        seed=seed,
+        parameters=parameters,
+        build_dir=build_dir,
+        waves=waves,
+        extra_env=extra_env,
+    )
+
+
+def run(hdl_toplevel: str, verilog_sources: Sequence[Path],
+        test_module: Optional[str] = None,
+        parameters: Optional[Mapping[str, object]] = None,
+        build_args: Sequence[str] = (),
+        testcase: Optional[str] = None,
+        verilator: Optional[VerilatorOptions] = None) -> Path:
+    """
+    Builds (if necessary) and runs the cocotb tests of `hdl_toplevel`.
+    With `WAVES=fail` failing tests are repeated with the same seed on a
+    traced model.
+    """
+    mode = get_waves()
+    test_module = test_module or f"{hdl_toplevel}_test,"
+    args = (hdl_toplevel, verilog_sources, test_module, parameters,
+            build_args, verilator)
+
+    runner = get_runner(get_sim())
+    try:
+        return _test(runner, *args, testcase, waves=mode == "1")
+    except SystemExit:
+        if mode != "fail":
+            raise
+        # Without results the simulator crashed -> Repeat all tests
+        failed, seed = testcase, None
+        with suppress(KeyError, OSError, ET.ParseError):
+            results_xml = Path(runner.env["COCOTB_RESULTS_FILE"])
+            failed = ",".join(failed_tests(results_xml)) or testcase
+            seed = random_seed(results_xml)
+
+        traced = get_runner(get_sim())
+        reproduced = False
+        try:
+            _test(traced, *args, failed, waves=True, seed=seed)
+        except SystemExit:
+            reproduced = True
+        if reproduced:
+            log.info("Waveforms of failed tests in %s", traced.test_dir)
+        else:
+            log.warning("Traced re-run of %s with RANDOM_SEED=%s passed, the "
+                        "failure depends on more than the seed. Waveforms in "
+                        "%s", failed or "all tests", seed, traced.test_dir)
+        raise
@@ -0,0 +1,203 @@
+"""
+Vectorized stimulus and expected results.
+
+Whole transaction streams and the outputs they must produce are generated up
+front as NumPy arrays. Coroutines then only index precomputed buffers (ideally
+converted once with `tolist()`), so Python no longer dominates the simulation.
+
+Random generators take a `numpy.random.Generator`, see `rng()`.
+"""
+import random
+from typing import Dict, Optional
+
+import numpy as np
+
+# Line levels and data are stored in the smallest type that holds them
+LEVEL = np.uint8
+DATA = np.uint64
+
+# (P(we), P(re)) of FIFO bursts: Fill, drain, balanced, simultaneous
+FIFO_BIASES = np.array([(0.9, 0.1), (0.1, 0.9), (0.5, 0.5), (1.0, 1.0)])
+
+
+def rng(seed: Optional[int] = None) -> np.random.Generator:
+    """
+    Generator seeded from `random`, which cocotb seeds with `RANDOM_SEED`.
+    Thus a failing run is reproduced by the same seed.
+    """
+    return np.random.default_rng(random.getrandbits(64) if seed is None
+                                 else seed)
+
+
+def random_data(gen: np.random.Generator, count: int,
+                data_width: int) -> np.ndarray:
+    """`count` uniformly distributed words of `data_width` bits"""
+    assert 0 < data_width <= 64, f"Unsupported data width: {data_width}"
+    return gen.integers(0, 2**data_width, size=count, dtype=DATA)
+
+
+def symbols(gen: np.random.Generator, count: int, bits: int) -> np.ndarray:
+    """
+    Corner cases (all zeros and ones, the single end bits, alternating bits),
+    followed by random symbols up to `count` in total
+    """
+    mask = 2**bits - 1
+    alternating = int("01" * bits, 2) & mask
+    corners = np.array([0, mask, 1, 1 << (bits - 1), alternating,
+                        alternating ^ mask], dtype=DATA)
+    return np.concatenate([corners[:count],
+                           random_data(gen, max(count - len(corners), 0),
+                                       bits)])
+
+
+def data_bits(values: np.ndarray, bits: int) -> np.ndarray:
+    """Bits of each value, LSB first. Shape: (len(values), bits)"""
+    shifts = np.arange(bits, dtype=DATA)
+    return ((np.asarray(values, dtype=DATA)[:, None] >> shifts) & 1) \
+        .astype(LEVEL)
+
+
+def parity_bits(values: np.ndarray, bits: int = 8,
+                parity_odd: bool = False) -> np.ndarray:
+    """Parity bit of each value over its lower `bits` bits"""
+    return (data_bits(values, bits).sum(axis=1, dtype=LEVEL) + parity_odd) & 1
+
+
+def uart_frames(values: np.ndarray, bits: int = 8, parity: bool = False,
+                parity_odd: bool = False, stop_bits: int = 1) -> np.ndarray:
+    """
+    Line levels of one UART frame per value in order of transmission:
+    Start bit, data bits (LSB first), optional parity bit and stop bits.
+    Shape: (len(values), 1 + bits + parity + stop_bits)
+    """
+    values = np.asarray(values, dtype=DATA)
+    columns = [np.zeros((len(values), 1), dtype=LEVEL),
+               data_bits(values, bits)]
+    if parity:
+        columns.append(parity_bits(values, bits, parity_odd)[:, None])
+    columns.append(np.ones((len(values), stop_bits), dtype=LEVEL))
+    return np.hstack(columns)
+
+
+def ram_transactions(gen: np.random.Generator, depth: int, data_width: int,
+                     cycles: int, p_we: float = 0.5,
+                     p_re: float = 0.5) -> Dict[str, np.ndarray]:
+    """
+    Random inputs of `ram_partial_dp_scd` per cycle. Addresses are drawn from
+    a quarter of the memory in half of the cycles, so writes and reads of the
+    same address (including short circuits) are frequent even for deep RAMs.
+    """
+    hot = max(depth // 4, 1)
+    narrow = gen.random(cycles) < 0.5
+    w_addr = np.where(narrow, gen.integers(0, hot, cycles),
+                      gen.integers(0, depth, cycles))
+    r_addr = np.where(narrow, gen.integers(0, hot, cycles),
+                      gen.integers(0, depth, cycles))
+    return {
+        "we": gen.random(cycles) < p_we,
+        "w_addr": w_addr,
+        "w_data": random_data(gen, cycles, data_width),
+        "re": gen.random(cycles) < p_re,
+        "r_addr": r_addr,
+    }
+
+
+def ram_expected(we: np.ndarray, w_addr: np.ndarray, w_data: np.ndarray,
+                 re: np.ndarray, r_addr: np.ndarray,
+                 short_circuit: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Combinational `r_data` of each cycle, before its rising edge. It is the
+    last value written to `r_addr` in a previous cycle or with `short_circuit`
+    `w_data` when both ports access the same address, and 0 without `re`.
+    `known` is false for reads of never written addresses.
+    """
+    cycles = len(we)
+    time = np.arange(cycles)
+
+    # Writes sorted by (address, time), searched for the last previous one
+    writes = np.flatnonzero(we)
+    write_keys = w_addr[writes].astype(np.int64) * cycles + writes
+    order = np.argsort(write_keys, kind="stable")
+    write_keys, writes = write_keys[order], writes[order]
+
+    read_keys = r_addr.astype(np.int64) * cycles + time
+    last = np.searchsorted(write_keys, read_keys, side="left") - 1
+    written = last >= 0
+    written[written] = write_keys[last[written]] // cycles == \
+        r_addr[written]
+
+    r_data = np.zeros(cycles, dtype=DATA)
+    r_data[written] = w_data[writes[last[written]]]
+
+    passed = re & we & (w_addr == r_addr) & short_circuit
+    r_data[passed] = w_data[passed]
+    r_data[~re] = 0
+
+    return {"r_data": r_data, "known": ~re | written | passed}
+
+
+def fifo_transactions(gen: np.random.Generator, depth: int, data_width: int,
+                      cycles: int) -> Dict[str, np.ndarray]:
+    """
+    Constrained random inputs of `fifo_simple` per cycle. Starts with a
+    complete fill and drain, followed by bursts of up to twice the depth with
+    a random bias out of `FIFO_BIASES`.
+    """
+    sweep = np.repeat([(True, False), (False, True)], depth, axis=0)
+    remaining = max(cycles - len(sweep), 0)
+
+    # Burst lengths are at least 1 -> `remaining` bursts always suffice
+    lengths = gen.integers(1, 2 * depth, size=remaining, endpoint=True)
+    bursts = np.searchsorted(np.cumsum(lengths), remaining) + 1
+    biases = FIFO_BIASES[gen.integers(len(FIFO_BIASES), size=bursts)]
+    p = np.repeat(biases, lengths[:bursts], axis=0)[:remaining]
+
+    random_ports = gen.random((remaining, 2)) < p
+    ports = np.vstack([sweep, random_ports])[:cycles]
+    return {
+        "we": ports[:, 0],
+        "re": ports[:, 1],
+        "din": random_data(gen, len(ports), data_width),
+    }
+
+
+def fifo_expected(we: np.ndarray, re: np.ndarray, din: np.ndarray,
+                  depth: int, almost_full: Optional[int] = None,
+                  almost_empty: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    Outputs of `fifo_simple` of each cycle, before its rising edge. The
+    saturating occupancy is a sequential recurrence and computed in a single
+    pass over plain integers, data is then gathered vectorized. Thresholds
+    default to the ones of `fifo_simple`.
+    """
+    capacity = depth
+    if almost_full is None:
+        almost_full = depth - depth // 4
+    if almost_empty is None:
+        almost_empty = depth // 4
+    cycles = len(we)
+    entries = np.empty(cycles, dtype=np.int64)
+    push = np.empty(cycles, dtype=bool)
+    pop = np.empty(cycles, dtype=bool)
+
+    size = 0
+    for t, (w, r) in enumerate(zip(we.tolist(), re.tolist())):
+        entries[t] = size
+        # Passthrough when empty, simultaneous write and read when full
+        pop[t] = r_granted = r and (size > 0 or w)
+        push[t] = w_granted = w and (size < capacity or r)
+        size += w_granted - r_granted
+
+    # The k-th granted read returns the k-th granted write
+    pushed = din[push]
+    dout = np.zeros(cycles, dtype=DATA)
+    dout[pop] = pushed[np.cumsum(pop)[pop] - 1]
+
+    return {
+        "entries": entries,
+        "full": entries == capacity,
+        "empty": entries == 0,
+        "almost_full": entries >= almost_full,
+        "almost_empty": entries <= almost_empty,
+        "dout": dout,
+    }
@@ -0,0 +1,120 @@
+"""
+Suite-level scheduling of the simulator processes.
+
+Every `test_runner()` launches a single simulator process, which runs all
+cocotb tests of its module for one toplevel and parameter set on one cached
+build - the minimum number of processes. The pytest hooks in `conftest.py` use
+this module to balance these processes across xdist workers by their runtime
+recorded in `tb.perf`, instead of by file:
+- Processes are ordered longest first, so `--dist load` packs them greedily
+- A module whose expected runtime exceeds a worker's fair share is split into
+  testcase shards, which run in parallel on the same build
+
+The controller takes a snapshot of the recorded runtimes (`RUNTIMES_ENV`), so
+that all workers collect identical shards while new runtimes are recorded.
+"""
+import heapq
+import json
+import math
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cocotb.decorators
+
+from tb import perf
+
+RUNTIMES_ENV = "SUITE_RUNTIMES"
+
+# toplevel -> parameter id -> cocotb test -> wall time
+Runtimes = Dict[str, Dict[str, Dict[str, float]]]
+
+
+def recorded_runtimes(build_root: Path) -> Runtimes:
+    """Latest wall time of every recorded test"""
+    runtimes: Runtimes = {}
+    for run in perf.latest(build_root):
+        runtimes.setdefault(run["toplevel"], {}) \
+            .setdefault(run["parameters"], {})[run["test"]] = run["wall_s"]
+    return runtimes
+
+
+def snapshot(build_root: Path, workers: int) -> None:
+    """Stores the runtimes for the workers, which are started afterwards"""
+    os.environ[RUNTIMES_ENV] = json.dumps({
+        "workers": workers,
+        "runtimes": recorded_runtimes(build_root),
+    })
+
+
+def load_snapshot() -> dict:
+    return json.loads(os.getenv(RUNTIMES_ENV, '{"workers": 1, "runtimes": {}}'))
+
+
+def cocotb_tests(module) -> List[str]:
+    """Names of all cocotb tests in a test module, in order of definition"""
+    return [name for name, value in vars(module).items()
+            if isinstance(value, cocotb.decorators.test)]
+
+
+def test_runtimes(runtimes: Runtimes, toplevel: str,
+                  parameter_id: Optional[str] = None) -> Dict[str, float]:
+    """
+    Runtime per cocotb test of a parameter set. Without `parameter_id`, the
+    slowest of all parameter sets.
+    """
+    parameter_sets = runtimes.get(toplevel, {})
+    if parameter_id is not None:
+        return parameter_sets.get(parameter_id, {})
+
+    slowest: Dict[str, float] = {}
+    for tests in parameter_sets.values():
+        for test, wall_s in tests.items():
+            slowest[test] = max(wall_s, slowest.get(test, 0.0))
+    return slowest
+
+
+def shards(tests: List[str], durations: Dict[str, float],
+           target_s: float) -> List[Optional[str]]:
+    """
+    Splits `tests` into as few `TESTCASE` lists as possible, where each one
+    should finish within `target_s` (longest processing time first).
+    Tests without recorded duration count as instantaneous. `None` runs all.
+    """
+    total = sum(durations.get(test, 0.0) for test in tests)
+    count = min(len(tests), math.ceil(total / target_s)) if target_s else 1
+    if count <= 1:
+        return [None]
+
+    # (load, index, tests)
+    bins = [(0.0, i, []) for i in range(count)]
+    for test in sorted(tests, key=lambda t: -durations.get(t, 0.0)):
+        load, i, members = heapq.heappop(bins)
+        members.append(test)
+        heapq.heappush(bins, (load + durations.get(test, 0.0), i, members))
+
+    order = {test: i for i, test in enumerate(tests)}
+    return [",".join(sorted(members, key=order.__getitem__))
+            for _, _, members in sorted(bins, key=lambda b: b[1])]
+
+
+def plan(module, toplevel: str, snapshot: dict) -> List[Optional[str]]:
+    """Testcase shards of a test module, see `shards`"""
+    runtimes = snapshot["runtimes"]
+    total = sum(wall_s for toplevel_runtimes in runtimes.values()
+                for tests in toplevel_runtimes.values()
+                for wall_s in tests.values())
+    target_s = total / snapshot["workers"] if snapshot["workers"] > 1 else 0
+    return shards(cocotb_tests(module), test_runtimes(runtimes, toplevel),
+                  target_s)
+
+
+def expected_runtime(snapshot: dict, toplevel: str,
+                     parameter_id: Optional[str],
+                     testcase: Optional[str]) -> float:
+    """Expected wall time of one simulator process. Unknown ones are `inf`"""
+    durations = test_runtimes(snapshot["runtimes"], toplevel, parameter_id)
+    tests = testcase.split(",") if testcase else list(durations)
+    if not tests or any(test not in durations for test in tests):
+        return math.inf
+    return sum(durations[test] for test in tests)
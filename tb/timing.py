@@ -0,0 +1,114 @@
+"""
+Exact clock and UART bit timing. All periods are in ps.
+
+Defaults can be overridden with `CLK_HZ` and `BAUD` to sweep combinations
+without editing the tests.
+"""
+import os
+from fractions import Fraction
+from typing import Optional, Tuple
+
+CLK_HZ: int = int(os.getenv("CLK_HZ", "50000000"))
+BAUD: int = int(os.getenv("BAUD", "115200"))
+# Width of `baud_divider` in uart_tx and uart_rx
+BAUD_WIDTH: int = 12
+# Width of `baud_fraction` in uart_tx and uart_rx (uart_baud_fraction)
+FRACTION_WIDTH: int = 4
+# Time precision of the RTL (`timescale 1us/1ns), the clock toggles on it
+SIM_PRECISION_PS: int = 1000
+# Typical tolerance of a receiver for the combined error of both link partners
+MAX_BAUD_ERROR: float = 0.02
+
+
+def period_ps(freq_hz: int) -> Fraction:
+    return Fraction(10**12, freq_hz)
+
+
+def clk_period_ps(clk_hz: int = CLK_HZ,
+                  precision_ps: int = SIM_PRECISION_PS) -> int:
+    """
+    Clock period. The half period must be a multiple of the simulator
+    precision `precision_ps` to be simulated exactly
+    """
+    half_period = period_ps(clk_hz) / 2
+    if half_period % precision_ps:
+        raise ValueError(f"Clock of {clk_hz} Hz has a half period of "
+                         f"{float(half_period)} ps, which is no multiple of "
+                         f"the {precision_ps} ps precision")
+    return int(2 * half_period)
+
+
+def bit_cycles(baud_divider: int) -> int:
+    """Clock cycles per bit. The baud counter counts from 0 to `baud_divider`"""
+    return baud_divider + 1
+
+
+def baud_divider(baud: int, clk_hz: int = CLK_HZ) -> int:
+    """Divider with the closest bit period to `baud`"""
+    return round(Fraction(clk_hz, baud)) - 1
+
+
+def fractional_divider(baud: int, clk_hz: int = CLK_HZ,
+                       fraction_width: int = FRACTION_WIDTH) -> Tuple[int, int]:
+    """
+    Divider and fraction with the closest average bit period to `baud`. A bit
+    lasts `bit_cycles(divider) + fraction / 2**fraction_width` cycles
+    """
+    steps = round(Fraction(clk_hz, baud) * 2**fraction_width)
+    return steps // 2**fraction_width - 1, steps % 2**fraction_width
+
+
+class UartTiming:
+    """
+    Bit timing of uart_tx and uart_rx for `baud` at `clk_hz`. Raises
+    ValueError if the divider does not fit into `baud_width` bits or the
+    relative baud error exceeds `max_error` (`None` disables the check).
+    With `fractional`, bits are extended by single cycles to approximate the
+    ideal period on average (`fraction`), otherwise `fraction` is 0.
+    """
+
+    def __init__(self, baud: int = BAUD, clk_hz: int = CLK_HZ,
+                 baud_width: int = BAUD_WIDTH,
+                 max_error: Optional[float] = MAX_BAUD_ERROR,
+                 fractional: bool = False,
+                 fraction_width: int = FRACTION_WIDTH):
+        self.baud = baud
+        self.clk_hz = clk_hz
+        self.clk_period_ps = clk_period_ps(clk_hz)
+
+        if fractional:
+            self.divider, self.fraction = fractional_divider(
+                baud, clk_hz, fraction_width)
+        else:
+            self.divider, self.fraction = baud_divider(baud, clk_hz), 0
+        if not 0 <= self.divider < 2**baud_width:
+            raise ValueError(f"Divider {self.divider} for {baud} baud at "
+                             f"{clk_hz} Hz exceeds {baud_width} bits")
+
+        # Shortest bit, one cycle longer if extended by the fraction
+        self.bit_cycles = bit_cycles(self.divider)
+        # Average bit period
+        self.bit_period_ps: Fraction = \
+            (self.bit_cycles + Fraction(self.fraction, 2**fraction_width)) \
+            * self.clk_period_ps
+        self.ideal_bit_period_ps: Fraction = period_ps(baud)
+
+        if max_error is not None and abs(self.baud_error) > max_error:
+            raise ValueError(f"Baud error of {self.baud_error:.2%} for {baud} "
+                             f"baud at {clk_hz} Hz exceeds {max_error:.2%}")
+
+    @property
+    def baud_error(self) -> float:
+        """Relative error of the actual to the ideal bit period"""
+        return float(self.bit_period_ps / self.ideal_bit_period_ps - 1)
+
+    def frame_cycles(self, bits: int = 8, parity: bool = False,
+                     stop_bits: int = 1) -> int:
+        """Clock cycles of a frame, rounded up for fractional bits"""
+        return (1 + bits + int(parity) + stop_bits) \
+            * (self.bit_cycles + int(self.fraction > 0))
+
+    def __repr__(self) -> str:
+        return (f"UartTiming(baud={self.baud}, clk_hz={self.clk_hz}, "
+                f"divider={self.divider}, fraction={self.fraction}, "
+                f"error={self.baud_error:.3%})")
@@ -0,0 +1,164 @@
+"""
+Simulated-time budgets of tests and bounded waits.
+
+`runner.run` loads this module into every simulation. Each test runs within a
+budget of `BUDGET_CYCLES` clock cycles (default: ten million, 200 ms at 50
+MHz). Tests of known length declare their own budget, e.g.
+
+    watchdog.budget(2 * len(values) * uart_timing.frame_cycles())
+
+Once the budget is used up, the test fails with a `Timeout` that shows where
+the test waits and the values of all signals of the module, instead of
+simulating as long as the clock runs. Waits that must complete within a few
+cycles are bounded individually:
+
+    await watchdog.wait(dut, RisingEdge(dut.error_detected), cycles,
+                        "Invalid start bit should cause error")
+"""
+import os
+from typing import List, Optional
+
+import cocotb
+from cocotb import simulator
+from cocotb.binary import BinaryValue
+from cocotb.handle import HierarchyObject, NonHierarchyIndexableObject
+from cocotb.result import SimTimeoutError
+from cocotb.task import Task
+from cocotb.triggers import Timer, with_timeout
+from cocotb.utils import get_sim_time
+
+from tb import hooks
+from tb.timing import clk_period_ps
+
+
+class Timeout(SimTimeoutError):
+    """A test or a wait exceeded its simulated-time budget"""
+
+
+# Expires the budget of the running test
+_expiry: Optional[Task] = None
+
+
+def default_budget() -> int:
+    """Clock cycles per test selected via `BUDGET_CYCLES`"""
+    return int(os.getenv("BUDGET_CYCLES", "10000000"))
+
+
+def _format(value) -> str:
+    if isinstance(value, BinaryValue):
+        if value.is_resolvable and value.n_bits > 1:
+            return f"{value.integer:#x}"
+        return value.binstr
+    return str(value)
+
+
+def snapshot(handle, depth: int = 2, prefix: str = "") -> List[str]:
+    """
+    `name = value` of all signals and parameters of `handle` and its
+    submodules up to `depth` levels. Memories are only listed with their size.
+    """
+    lines = []
+    handle._discover_all()
+    for name, child in sorted(handle._sub_handles.items()):
+        if isinstance(child, list):
+            continue  # Generate blocks
+        if isinstance(child, HierarchyObject):
+            if depth > 1:
+                lines.extend(snapshot(child, depth - 1, f"{prefix}{name}."))
+        elif child._handle.get_type() in (simulator.MEMORY,
+                                          simulator.NETARRAY):
+            lines.append(f"{prefix}{name}[{len(child)}]")
+        elif isinstance(child, NonHierarchyIndexableObject):
+            # Packed vectors are indexable in Verilator
+            binstr = child._handle.get_signal_val_binstr()
+            value = BinaryValue(binstr, n_bits=len(binstr))
+            lines.append(f"{prefix}{name} = {_format(value)}")
+        else:
+            lines.append(f"{prefix}{name} = {_format(child.value)}")
+    return lines
+
+
+def _waiting_at(task) -> List[str]:
+    """Source lines the coroutines of `task` are suspended at, outermost first"""
+    lines = []
+    coro = getattr(task, "_coro", None)
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or \
+            getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        trigger = frame.f_locals.get("self")
+        if frame.f_code.co_name == "__await__" and trigger is not None:
+            lines.append(repr(trigger))
+            break
+        lines.append(f"{frame.f_code.co_filename}:{frame.f_lineno} "
+                     f"in {frame.f_code.co_name}")
+        coro = getattr(coro, "cr_await", None) or \
+            getattr(coro, "gi_yieldfrom", None)
+    return lines
+
+
+def _diagnosis(dut, reason: str, task=None) -> str:
+    lines = [f"{reason} at {get_sim_time('ns'):.0f} ns"]
+    if task is not None:
+        lines.append("Waiting at:")
+        lines.extend(f"  {line}" for line in _waiting_at(task))
+    lines.append(f"State of {dut._name}:")
+    lines.extend(f"  {line}" for line in snapshot(dut))
+    return "\n".join(lines)
+
+
+async def _expire(dut, test: str, cycles: int, period_ps: int) -> None:
+    await Timer(cycles * period_ps, "ps")
+    raise Timeout(_diagnosis(
+        dut, f"{test} exceeded its budget of {cycles} cycles",
+        hooks.attribute(cocotb.regression_manager, "_test_task")))
+
+
+def budget(cycles: int, period_ps: Optional[int] = None) -> None:
+    """
+    Replaces the budget of the running test: It fails unless it ends within
+    `cycles` periods of `period_ps` (default: `CLK_HZ`) from now.
+    """
+    global _expiry
+    period_ps = clk_period_ps() if period_ps is None else period_ps
+    if _expiry is not None:
+        _expiry.kill()
+    manager = cocotb.regression_manager
+    _expiry = cocotb.start_soon(_expire(
+        hooks.attribute(manager, "_dut"),
+        hooks.attribute(manager, "_test").__qualname__, cycles, period_ps))
+
+
+async def wait(dut, trigger, cycles: int, message: Optional[str] = None,
+               period_ps: Optional[int] = None):
+    """
+    Awaits `trigger` for at most `cycles` periods of `period_ps` (default:
+    `CLK_HZ`) and fails with `message` and the state of `dut` otherwise
+    """
+    period_ps = clk_period_ps() if period_ps is None else period_ps
+    try:
+        return await with_timeout(trigger, cycles * period_ps, "ps")
+    except SimTimeoutError:
+        raise Timeout(_diagnosis(
+            dut, f"{message or trigger} within {cycles} cycles")) from None
+
+
+def install() -> None:
+    """Starts the default budget with every test of this simulation"""
+    from cocotb.regression import RegressionManager
+
+    def wrap_start_test(start_test):
+        def _start_test(self):
+            global _expiry
+            _expiry = None
+            start_test(self)
+            budget(default_budget())
+        return _start_test
+
+    hooks.wrap(RegressionManager, "_start_test", ["self"], wrap_start_test)
+
+
+# Imported by cocotb as part of `MODULE` -> Guard all tests of this simulation
+if cocotb.SIM_NAME is not None:
+    install()